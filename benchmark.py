@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import random
+import time
+import robbotv2 as bot
+from localtransport import LocalTransport, LocalChannel, LocalMember
+
+class PhaseTimings:
+    def __init__(self):
+        self.samples = dict()
+    def add(self, phase, seconds):
+        self.samples.setdefault(phase, []).append(seconds)
+    def report(self):
+        lines = []
+        for phase in sorted(self.samples):
+            s = sorted(self.samples[phase])
+            p50 = s[len(s) // 2]
+            p95 = s[min(len(s) - 1, (len(s) * 95) // 100)]
+            lines.append(f'    {phase:<28} n={len(s):<7} p50={p50 * 1000:.3f}ms p95={p95 * 1000:.3f}ms max={s[-1] * 1000:.3f}ms')
+        return "\n".join(lines)
+
+class ScriptedGame:
+    def __init__(self, transport, channelName, playerCount, seed, timings):
+        self.transport = transport
+        self.rng = random.Random(seed)
+        self.channel = transport.channel(channelName, seed)
+        self.players = [transport.member("p" + str(i + 1)) for i in range(playerCount)]
+        self.timings = timings
+        self.inputs = 0
+    async def timed(self, phase, action):
+        start = time.perf_counter()
+        await action
+        self.timings.add(phase, time.perf_counter() - start)
+        self.inputs = self.inputs + 1
+    async def command(self, member, content):
+        await self.timed(content, self.transport.say(member, self.channel, content))
+    async def answerPrompts(self, maxInputs):
+        while self.inputs < maxInputs:
+            waiting = [m for m in self.players if bot.getRoutedPrompt(m) is not None]
+            if len(waiting) == 0:
+                return
+            member = self.rng.choice(waiting)
+            prompt = bot.getRoutedPrompt(member)
+            phase = prompt.choiceLogic.__name__
+            await self.timed(phase, self.transport.dm(member, self.rng.choice(prompt.choices)))
+    async def play(self, endCommand, maxInputs):
+        for m in self.players:
+            await self.command(m, "join")
+        await self.command(self.players[0], "start")
+        await self.answerPrompts(maxInputs)
+        if endCommand:
+            await self.command(self.players[0], "end")
+            await self.answerPrompts(maxInputs)
+        for m in self.players:
+            await self.command(m, "leave")
+        bot.sessions.pop(bot.getSessionKey(self.channel), None)
+
+class CoreGame:
+    def __init__(self, channelName, playerCount, seed, timings):
+        self.rng = random.Random(seed)
+        self.channel = LocalChannel(None, 0, channelName, None)
+        self.game = bot.gameTypes[channelName](channelName, seed)
+        self.players = [LocalMember(None, i + 1, "p" + str(i + 1)) for i in range(playerCount)]
+        self.timings = timings
+        self.inputs = 0
+        self.effects = 0
+    def timed(self, phase, action, *args):
+        start = time.perf_counter()
+        action(*args)
+        self.timings.add(phase, time.perf_counter() - start)
+        self.inputs = self.inputs + 1
+        self.effects = self.effects + len(self.game.takeEffects())
+        self.game.takeDeadlines()
+    def command(self, member, content):
+        self.timed(content, bot.handle_game_message, self.game, member, content, self.channel)
+    def answerPrompts(self, maxInputs):
+        while self.inputs < maxInputs:
+            waiting = [m for m in self.players if bot.getRoutedPrompt(m) is not None]
+            if len(waiting) == 0:
+                return
+            member = self.rng.choice(waiting)
+            prompt = bot.getRoutedPrompt(member)
+            self.timed(prompt.choiceLogic.__name__, prompt.answer, self.rng.choice(prompt.choices))
+    def play(self, endCommand, maxInputs):
+        for m in self.players:
+            self.command(m, "join")
+        self.command(self.players[0], "start")
+        self.answerPrompts(maxInputs)
+        if endCommand:
+            self.command(self.players[0], "end")
+            self.answerPrompts(maxInputs)
+        for m in self.players:
+            self.command(m, "leave")
+        self.game.teardown()
+
+scenarios = [
+    ("secret-hitler", "sh_players", False),
+    ("one-night-werewolf", "onw_players", True),
+    ("fake-artist", "fa_players", True),
+]
+
+async def runScenario(channelName, playerCount, endCommand, args):
+    transport = LocalTransport(bot)
+    timings = PhaseTimings()
+    inputs = 0
+    start = time.perf_counter()
+    for i in range(args.games):
+        game = ScriptedGame(transport, channelName, playerCount, args.seed + i, timings)
+        await game.play(endCommand, args.max_inputs)
+        inputs = inputs + game.inputs
+    elapsed = time.perf_counter() - start
+    print(f'{channelName} ({playerCount} players, {args.games} games)')
+    print(f'  games/s:        {args.games / elapsed:.1f}')
+    print(f'  messages/game:  {len(transport.sent) / args.games:.1f}')
+    print(f'  inputs/game:    {inputs / args.games:.1f}')
+    print('  phase latency:')
+    print(timings.report())
+
+def runCoreScenario(channelName, playerCount, endCommand, args):
+    timings = PhaseTimings()
+    inputs = 0
+    effects = 0
+    start = time.perf_counter()
+    for i in range(args.games):
+        game = CoreGame(channelName, playerCount, args.seed + i, timings)
+        game.play(endCommand, args.max_inputs)
+        inputs = inputs + game.inputs
+        effects = effects + game.effects
+    elapsed = time.perf_counter() - start
+    print(f'{channelName} core ({playerCount} players, {args.games} games)')
+    print(f'  games/s:        {args.games / elapsed:.1f}')
+    print(f'  effects/game:   {effects / args.games:.1f}')
+    print(f'  inputs/game:    {inputs / args.games:.1f}')
+    print('  phase latency:')
+    print(timings.report())
+
+async def main(args):
+    bot.sendPeriod = args.send_period
+    bot.defaultDelivery = args.delivery
+    if args.timeline:
+        bot.startTimeline(args.timeline)
+    for channelName, playersArg, endCommand in scenarios:
+        if args.only is None or args.only == channelName:
+            if args.core:
+                runCoreScenario(channelName, getattr(args, playersArg), endCommand, args)
+            else:
+                await runScenario(channelName, getattr(args, playersArg), endCommand, args)
+    if bot.timeline is not None:
+        bot.timeline.flush()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play scripted games through the local transport and report throughput")
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", choices=[s[0] for s in scenarios])
+    parser.add_argument("--sh-players", type=int, default=5)
+    parser.add_argument("--onw-players", type=int, default=5)
+    parser.add_argument("--fa-players", type=int, default=4)
+    parser.add_argument("--max-inputs", type=int, default=5000)
+    parser.add_argument("--core", action="store_true", help="step the synchronous game cores directly, without the event loop or transport")
+    parser.add_argument("--delivery", choices=bot.deliveryPolicies, default=bot.defaultDelivery)
+    parser.add_argument("--timeline", help="write per-phase spans in Chrome trace format to this file")
+    parser.add_argument("--send-period", type=float, default=0, help="per-destination rate limit window in seconds, 0 disables it")
+    args = parser.parse_args()
+    asyncio.run(main(args))
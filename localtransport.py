@@ -0,0 +1,80 @@
+import itertools
+import time
+import discord
+
+localIds = itertools.count(1)
+
+class SentMessage:
+    def __init__(self, channel, content):
+        self.time = time.perf_counter()
+        self.channel = channel
+        self.content = content
+
+class LocalGuild:
+    def __init__(self, id):
+        self.id = id
+        self.members = dict()
+    def get_member(self, id):
+        return self.members.get(id)
+
+class LocalChannel:
+    def __init__(self, transport, id, name, guild):
+        self.transport = transport
+        self.id = id
+        self.name = name
+        self.guild = guild
+    async def send(self, content):
+        self.transport.record(self, content)
+
+class LocalDMChannel(discord.DMChannel):
+    def __init__(self, transport, recipient):
+        self.transport = transport
+        self.id = recipient.id
+        self.recipient = recipient
+    async def send(self, content):
+        self.transport.record(self, content)
+
+class LocalMember:
+    def __init__(self, transport, id, name):
+        self.transport = transport
+        self.id = id
+        self.name = name
+        self.dm_channel = None
+    async def create_dm(self):
+        if self.dm_channel is None:
+            self.dm_channel = LocalDMChannel(self.transport, self)
+        return self.dm_channel
+
+class LocalMessage:
+    def __init__(self, author, channel, content):
+        self.author = author
+        self.channel = channel
+        self.content = content
+
+class LocalTransport:
+    def __init__(self, bot, guildId=None):
+        self.bot = bot
+        self.guild = LocalGuild(guildId if guildId is not None else self.newId())
+        self.sent = []
+    def newId(self):
+        return next(localIds)
+    def record(self, channel, content):
+        self.sent.append(SentMessage(channel, content))
+    def channel(self, name, seed=None):
+        channel = LocalChannel(self, self.newId(), name, self.guild)
+        if seed is not None:
+            game = self.bot.getGame(channel)
+            if game is not None:
+                game.rng.seed(seed)
+        return channel
+    def member(self, name):
+        member = LocalMember(self, self.newId(), name)
+        self.guild.members[member.id] = member
+        return member
+    async def say(self, member, channel, content):
+        await self.bot.on_message(LocalMessage(member, channel, content))
+    async def dm(self, member, content):
+        channel = await member.create_dm()
+        await self.bot.on_message(LocalMessage(member, channel, content))
+    def sentTo(self, channel):
+        return [m.content for m in self.sent if m.channel == channel]
@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import robbotv2 as bot
+from benchmark import PhaseTimings
+from localtransport import LocalTransport, LocalGuild, LocalChannel, LocalMember
+
+class TraceReplayer:
+    def __init__(self, events):
+        self.events = events
+        self.transport = LocalTransport(bot)
+        self.guilds = dict()
+        self.channels = dict()
+        self.members = dict()
+        self.timings = PhaseTimings()
+    def getChannel(self, ref):
+        guildId, channelId, name = ref
+        if channelId not in self.channels:
+            if guildId not in self.guilds:
+                self.guilds[guildId] = LocalGuild(guildId)
+            self.channels[channelId] = LocalChannel(self.transport, channelId, name, self.guilds[guildId])
+        return self.channels[channelId]
+    def getAuthor(self, ref, channel):
+        if "fake" in ref:
+            return bot.getFakePlayer(ref["fake"], channel)
+        member = self.members.get(ref["id"])
+        if member is None:
+            member = LocalMember(self.transport, ref["id"], ref["name"])
+            self.members[ref["id"]] = member
+        if channel is not None:
+            channel.guild.members[member.id] = member
+        return member
+    def loadSeeds(self):
+        for event in self.events:
+            if event["k"] == "random":
+                random.seed(event["seed"])
+            elif event["k"] == "seed":
+                bot.pendingSeeds.setdefault(tuple(event["s"]), []).append(event["seed"])
+    async def run(self, timing):
+        self.loadSeeds()
+        if timing:
+            bot.timers.start()
+        start = time.perf_counter()
+        for event in self.events:
+            kind = event["k"]
+            if kind != "g" and kind != "d":
+                continue
+            if timing:
+                delay = start + event["t"] - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            channel = self.getChannel(event["c"]) if "c" in event else None
+            author = self.getAuthor(event["a"], channel)
+            began = time.perf_counter()
+            if kind == "g":
+                await bot.handle_general_message(author, event["m"], channel)
+            else:
+                await bot.handle_direct_message(author, event["m"])
+            self.timings.add("general" if kind == "g" else "direct", time.perf_counter() - began)
+        return time.perf_counter() - start
+
+def readTrace(path):
+    events = []
+    with open(path) as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                pass
+    return events
+
+async def main(args):
+    bot.sendPeriod = args.send_period
+    replayer = TraceReplayer(readTrace(args.trace))
+    inbound = len([e for e in replayer.events if e["k"] == "g" or e["k"] == "d"])
+    elapsed = await replayer.run(args.timing == "original")
+    print(f'{args.trace} ({inbound} inbound events, {args.timing} timing)')
+    print(f'  elapsed:        {elapsed:.3f}s')
+    print(f'  events/s:       {inbound / elapsed:.1f}')
+    print(f'  messages sent:  {len(replayer.transport.sent)}')
+    print('  handler latency:')
+    print(replayer.timings.report())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a trace recorded with ROBBOT_TRACE through the message handlers")
+    parser.add_argument("trace")
+    parser.add_argument("--timing", choices=["fast", "original"], default="fast")
+    parser.add_argument("--send-period", type=float, default=0, help="per-destination rate limit window in seconds, 0 disables it")
+    asyncio.run(main(parser.parse_args()))
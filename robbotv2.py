@@ -3,7 +3,15 @@ import random
 import csv
 import discord
 import copy
-import threading
+import json
+import sqlite3
+import time
+import bisect
+import heapq
+import itertools
+import functools
+import contextlib
+import concurrent.futures
 import asyncio
 from discord.ext import commands
 from dotenv import load_dotenv
@@ -13,8 +21,84 @@ TOKEN = os.getenv('DISCORD_TOKEN')
 
 client = discord.Client()
 bot = commands.Bot(command_prefix = "!")
-safetyLock = threading.Lock()
-spinLock = 0
+
+class Histogram:
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum = self.sum + value
+        self.count = self.count + 1
+
+class Metrics:
+    def __init__(self):
+        self.counters = dict()
+        self.histograms = dict()
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = Histogram()
+            self.histograms[key] = histogram
+        histogram.observe(value)
+    def render(self):
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f'robbot_{name}{formatLabels(labels)} {value}')
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative = cumulative + count
+                lines.append(f'robbot_{name}_bucket{formatLabels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'robbot_{name}_sum{formatLabels(labels)} {histogram.sum}')
+            lines.append(f'robbot_{name}_count{formatLabels(labels)} {histogram.count}')
+        return "\n".join(lines) + "\n"
+    async def handleScrape(self, reader, writer):
+        try:
+            while (await reader.readline()).strip():
+                pass
+            body = self.render().encode()
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+            await writer.drain()
+        finally:
+            writer.close()
+    async def serve(self, port):
+        return await asyncio.start_server(self.handleScrape, "127.0.0.1", port)
+    def dump(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+    async def dumpPeriodically(self, path, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.dump(path)
+
+def formatLabels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+def timed(name):
+    def decorator(f):
+        @functools.wraps(f)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await f(*args, **kwargs)
+            finally:
+                metrics.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+metrics = Metrics()
+metricsStarted = False
 
 class FakeChannel:
     def __init__(self, header, baseChannel):
@@ -27,117 +111,745 @@ class FakeChannel:
 class FakePlayer:
     def __init__(self, name, baseChannel):
         self.name = name
+        self.id = "fake:" + name
         self.dm_channel = FakeChannel(name, baseChannel)
+        self.lastUsed = time.monotonic()
     async def create_dm(self):
-        return 0
+        return self.dm_channel
 
 fakePlayers = dict()
+fakePlayerLimit = int(os.getenv('ROBBOT_FAKE_PLAYER_LIMIT', '256'))
+fakePlayerTtl = float(os.getenv('ROBBOT_FAKE_PLAYER_TTL', '3600'))
 
 def getFakePlayer(name, baseChannel):
-    if name not in fakePlayers:
-        fakePlayers[name] = FakePlayer(name, baseChannel)
-    return fakePlayers[name]
+    player = fakePlayers.pop(name, None)
+    if player is None:
+        player = FakePlayer(name, baseChannel)
+    player.lastUsed = time.monotonic()
+    fakePlayers[name] = player
+    evictFakePlayers()
+    return player
+
+def evictFakePlayers():
+    now = time.monotonic()
+    for i in range(len(fakePlayers)):
+        name = next(iter(fakePlayers))
+        player = fakePlayers[name]
+        if len(fakePlayers) <= fakePlayerLimit and now - player.lastUsed < fakePlayerTtl:
+            return
+        del fakePlayers[name]
+        if player in memberGames:
+            #still seated in a game, keep it and look at it again later
+            player.lastUsed = now
+            fakePlayers[name] = player
+        else:
+            invalidateDMChannel(player)
+            metrics.inc("fake_players_evicted_total")
+
+dmChannels = dict()
+dmChannelLimit = int(os.getenv('ROBBOT_DM_CHANNEL_LIMIT', '1024'))
+
+async def getDMChannel(member):
+    channel = dmChannels.get(member.id)
+    if channel is None:
+        channel = await member.create_dm()
+        dmChannels[member.id] = channel
+        if len(dmChannels) > dmChannelLimit:
+            del dmChannels[next(iter(dmChannels))]
+    return channel
+
+def invalidateDMChannel(member):
+    dmChannels.pop(member.id, None)
+
+promptRoutes = dict()
+memberGames = dict()
+
+def routePrompt(prompt):
+    promptRoutes.setdefault(prompt.member, []).append(prompt)
+
+def unroutePrompt(prompt):
+    pending = promptRoutes.get(prompt.member)
+    if pending is not None and prompt in pending:
+        pending.remove(prompt)
+        if len(pending) == 0:
+            del promptRoutes[prompt.member]
+
+def isRouted(prompt):
+    return prompt in promptRoutes.get(prompt.member, ())
+
+def getRoutedPrompt(member):
+    pending = promptRoutes.get(member)
+    if pending is None:
+        return None
+    return pending[0]
+
+maxConcurrentSends = 8
+discordMessageLimit = 2000
+promptPriority = 0
+infoPriority = 1
+chatterPriority = 2
+sendBurst = int(os.getenv('ROBBOT_SEND_BURST', '5'))
+sendPeriod = float(os.getenv('ROBBOT_SEND_PERIOD', '5'))
+outboxHighWater = int(os.getenv('ROBBOT_OUTBOX_HIGH_WATER', '500'))
+
+class SendSlots:
+    def __init__(self, slots):
+        self.slots = slots
+        self.waiting = []
+        self.order = itertools.count()
+    async def acquire(self, priority):
+        if self.slots > 0 and len(self.waiting) == 0:
+            self.slots = self.slots - 1
+            return
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.order), future))
+        await future
+    def release(self):
+        while len(self.waiting) > 0:
+            future = heapq.heappop(self.waiting)[2]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.slots = self.slots + 1
+
+sendSlots = SendSlots(maxConcurrentSends)
+
+async def limitedSend(send, priority=infoPriority):
+    await sendSlots.acquire(priority)
+    try:
+        return await send
+    finally:
+        sendSlots.release()
+
+async def sendDirect(member, message):
+    channel = await getDMChannel(member)
+    try:
+        await channel.send(message)
+    except discord.NotFound:
+        invalidateDMChannel(member)
+        channel = await getDMChannel(member)
+        await channel.send(message)
+
+class TokenBucket:
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    def delay(self):
+        self.refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+    def take(self):
+        self.tokens = self.tokens - 1
+    def full(self):
+        self.refill()
+        return self.tokens >= self.capacity
+
+def takeChunk(pending):
+    priority, message = pending.pop(0)
+    chunk = [message]
+    size = len(message)
+    while len(pending) > 0 and size + 1 + len(pending[0][1]) <= discordMessageLimit:
+        nextPriority, message = pending.pop(0)
+        priority = min(priority, nextPriority)
+        chunk.append(message)
+        size = size + 1 + len(message)
+    return priority, "\n".join(chunk)
+
+class Outbox:
+    bucketLimit = 4096
+    def __init__(self):
+        self.pending = dict()
+        self.flushes = dict()
+        self.buckets = dict()
+        self.backlog = 0
+    def queue(self, channel, message, priority=infoPriority):
+        return self.enqueue(channel, channel.send, message, priority)
+    def queueDM(self, member, message, priority=infoPriority):
+        return self.enqueue(member.id, lambda chunk: sendDirect(member, chunk), message, priority)
+    def congested(self):
+        return self.backlog >= outboxHighWater
+    def enqueue(self, key, send, message, priority=infoPriority):
+        if key not in self.pending:
+            self.pending[key] = []
+            self.flushes[key] = asyncio.ensure_future(self.flush(key, send))
+        self.pending[key].append((priority, message))
+        self.backlog = self.backlog + 1
+        return self.flushes[key]
+    def getBucket(self, key):
+        if sendPeriod <= 0:
+            return None
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.bucketLimit:
+                self.buckets = {k: b for k, b in self.buckets.items() if k in self.pending or not b.full()}
+            bucket = TokenBucket(sendBurst, sendPeriod)
+            self.buckets[key] = bucket
+        return bucket
+    async def flush(self, key, send):
+        pending = self.pending[key]
+        bucket = self.getBucket(key)
+        error = None
+        try:
+            while len(pending) > 0:
+                if bucket is not None:
+                    delay = bucket.delay()
+                    if delay > 0:
+                        metrics.inc("outbound_throttled_total")
+                        await asyncio.sleep(delay)
+                        continue
+                    bucket.take()
+                before = len(pending)
+                priority, chunk = takeChunk(pending)
+                self.backlog = self.backlog - (before - len(pending))
+                metrics.inc("outbound_api_calls_total", priority=priorityNames[priority])
+                try:
+                    await limitedSend(send(chunk), priority)
+                except Exception as e:
+                    metrics.inc("outbound_failures_total")
+                    error = e
+        finally:
+            self.backlog = self.backlog - len(pending)
+            del self.pending[key]
+            del self.flushes[key]
+        if error is not None:
+            raise error
+
+priorityNames = ["prompt", "info", "chatter"]
+outbox = Outbox()
+
+async def fanOut(deliveries):
+    targets = list(deliveries.items())
+    results = await asyncio.gather(*[delivery for delivery, target in targets], return_exceptions=True)
+    failures = []
+    for (delivery, target), result in zip(targets, results):
+        if isinstance(result, Exception):
+            print(f'Failed to send to {target}: {result}')
+            failures.append((target, result))
+    return failures
+
+class BatchWriter:
+    writtenMetric = None
+    def __init__(self, flushInterval=1.0):
+        self.flushInterval = flushInterval
+        self.buffer = []
+        self.task = None
+    def append(self, record):
+        self.buffer.append(record)
+    def takeBuffer(self):
+        records = self.buffer
+        self.buffer = []
+        return records
+    def flush(self):
+        records = self.takeBuffer()
+        if len(records) > 0:
+            self.write(records)
+            self.written(records)
+    def written(self, records):
+        if self.writtenMetric is not None:
+            metrics.inc(self.writtenMetric, len(records))
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        failing = False
+        while True:
+            await asyncio.sleep(self.flushInterval)
+            records = self.takeBuffer()
+            if len(records) == 0:
+                continue
+            try:
+                await loop.run_in_executor(None, self.write, records)
+            except Exception as e:
+                #keep the batch for the next interval, the loop has to outlive a full disk or a locked database
+                self.buffer = records + self.buffer
+                metrics.inc("batch_write_failures_total")
+                if not failing:
+                    print(f'Failed to write {len(records)} records to {self.path}: {e!r}')
+                failing = True
+                continue
+            self.written(records)
+            if failing:
+                print(f'Writing to {self.path} recovered')
+            failing = False
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+class EventLog(BatchWriter):
+    def __init__(self, path, flushInterval=1.0):
+        BatchWriter.__init__(self, flushInterval)
+        self.path = path
+    def append(self, event):
+        self.buffer.append(json.dumps(event, separators=(",", ":")))
+    def write(self, lines):
+        data = memoryview(("\n".join(lines) + "\n").encode())
+        with open(self.path, "ab", buffering=0) as f:
+            start = f.seek(0, os.SEEK_END)
+            try:
+                while len(data) > 0:
+                    data = data[f.write(data):]
+                os.fsync(f.fileno())
+            except OSError:
+                #drop a partial batch so the retry does not duplicate events
+                f.truncate(start)
+                raise
+    def read(self):
+        events = []
+        if not os.path.exists(self.path):
+            return events
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    pass
+        return events
+    def rewrite(self, events):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            for event in events:
+                f.write(json.dumps(event, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
 
-async def doNothingCallback():
+eventLogPath = os.getenv('ROBBOT_EVENT_LOG', 'events.log')
+eventLog = None
+
+class StatsStore(BatchWriter):
+    writtenMetric = "stats_games_written_total"
+    def __init__(self, path, flushInterval=1.0):
+        BatchWriter.__init__(self, flushInterval)
+        self.path = path
+        self.writer = self.connect()
+        self.writer.executescript("""
+            CREATE TABLE IF NOT EXISTS games (id INTEGER PRIMARY KEY, type TEXT NOT NULL, channel TEXT, finished_at REAL NOT NULL, winner TEXT, players INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS roles (game INTEGER NOT NULL, player TEXT NOT NULL, name TEXT NOT NULL, role TEXT, won INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS votes (game INTEGER NOT NULL, round INTEGER NOT NULL, kind TEXT NOT NULL, voter TEXT NOT NULL, choice TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS player_totals (player TEXT NOT NULL, type TEXT NOT NULL, name TEXT NOT NULL, games INTEGER NOT NULL, wins INTEGER NOT NULL, PRIMARY KEY (player, type));
+            CREATE INDEX IF NOT EXISTS games_type ON games (type, finished_at);
+            CREATE INDEX IF NOT EXISTS roles_game ON roles (game);
+            CREATE INDEX IF NOT EXISTS roles_player ON roles (player);
+            CREATE INDEX IF NOT EXISTS votes_game ON votes (game);
+            CREATE INDEX IF NOT EXISTS player_totals_rank ON player_totals (type, wins DESC, games);
+        """)
+        self.reader = self.connect()
+        self.readExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    def connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+    def recordGame(self, game, winner):
+        players = [(str(m.id), m.name, game.getRoleLabel(m), 1 if game.isWinner(m, winner) else 0) for m in game.members]
+        self.append((game.gameType(), game.channel_name, time.time(), winner, players, list(game.voteHistory)))
+    def write(self, records):
+        with self.writer:
+            for gameType, channel, finishedAt, winner, players, votes in records:
+                gameId = self.writer.execute("INSERT INTO games (type, channel, finished_at, winner, players) VALUES (?, ?, ?, ?, ?)", (gameType, channel, finishedAt, winner, len(players))).lastrowid
+                self.writer.executemany("INSERT INTO roles (game, player, name, role, won) VALUES (?, ?, ?, ?, ?)", [(gameId,) + p for p in players])
+                self.writer.executemany("INSERT INTO votes (game, round, kind, voter, choice) VALUES (?, ?, ?, ?, ?)", [(gameId,) + v for v in votes])
+                self.writer.executemany("INSERT INTO player_totals (player, type, name, games, wins) VALUES (?, ?, ?, 1, ?) ON CONFLICT (player, type) DO UPDATE SET name = excluded.name, games = games + 1, wins = wins + excluded.wins", [(p[0], gameType, p[1], p[3]) for p in players])
+    def leaderboard(self, gameType, limit=10):
+        return self.reader.execute("SELECT name, wins, games FROM player_totals WHERE type = ? ORDER BY wins DESC, games LIMIT ?", (gameType, limit)).fetchall()
+    async def fetchLeaderboard(self, gameType, limit=10):
+        return await asyncio.get_event_loop().run_in_executor(self.readExecutor, self.leaderboard, gameType, limit)
+
+statsPath = os.getenv('ROBBOT_STATS_DB', 'stats.db')
+statsStore = None
+
+def startStats(path):
+    global statsStore
+    statsStore = StatsStore(path)
+    statsStore.start()
+
+def memberRef(member):
+    if isinstance(member, FakePlayer):
+        return {"fake": member.name}
+    return {"id": member.id, "name": member.name}
+
+tracePath = os.getenv('ROBBOT_TRACE')
+traceLog = None
+traceStart = time.monotonic()
+pendingSeeds = dict()
+
+def startTrace(path):
+    global traceLog, traceStart
+    traceLog = EventLog(path)
+    traceStart = time.monotonic()
+    seed = random.getrandbits(32)
+    random.seed(seed)
+    traceLog.append({"t": 0, "k": "random", "seed": seed})
+    traceLog.start()
+
+def traceEvent(kind, player, message, channel=None):
+    if traceLog is not None:
+        event = {"t": round(time.monotonic() - traceStart, 3), "k": kind, "a": memberRef(player), "m": message}
+        if channel is not None:
+            guild = getattr(channel, "guild", None)
+            event["c"] = [guild.id if guild is not None else None, channel.id, channel.name]
+        traceLog.append(event)
+
+timelinePath = os.getenv('ROBBOT_TIMELINE')
+timeline = None
+timelinePhaseLane = 0
+timelineBotLane = 1
+timelineHumanLane = 2
+timelineMemberLanes = 10
+timelinePids = itertools.count(1)
+
+class Timeline(EventLog):
+    def __init__(self, path, flushInterval=1.0):
+        EventLog.__init__(self, path, flushInterval)
+        self.origin = time.perf_counter()
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            self.buffer.append("[")
+    def append(self, event):
+        self.buffer.append(json.dumps(event, separators=(",", ":")) + ",")
+    def micros(self, t):
+        return round((t - self.origin) * 1000000)
+    def getPid(self, game):
+        if game.timelinePid is None:
+            game.timelinePid = next(timelinePids)
+            self.append({"name": "process_name", "ph": "M", "pid": game.timelinePid, "args": {"name": game.channel_name + " " + str(game.sessionKey)}})
+            for lane, name in ((timelinePhaseLane, "phases"), (timelineBotLane, "bot"), (timelineHumanLane, "humans")):
+                self.append({"name": "thread_name", "ph": "M", "pid": game.timelinePid, "tid": lane, "args": {"name": name}})
+        return game.timelinePid
+    def nameLane(self, game, lane, name):
+        self.append({"name": "thread_name", "ph": "M", "pid": self.getPid(game), "tid": lane, "args": {"name": name}})
+    def span(self, game, lane, name, begin, end, **args):
+        event = {"name": name, "ph": "X", "pid": self.getPid(game), "tid": lane, "ts": self.micros(begin), "dur": max(0, self.micros(end) - self.micros(begin))}
+        if len(args) > 0:
+            event["args"] = args
+        self.append(event)
+
+def startTimeline(path):
+    global timeline
+    timeline = Timeline(path)
+    timeline.start()
+
+def phase(f):
+    @functools.wraps(f)
+    def wrapper(self, *args):
+        previous = self.phaseName
+        self.phaseName = f.__name__
+        try:
+            return f(self, *args)
+        finally:
+            self.phaseName = previous
+    return wrapper
+
+def takePendingSeed(key):
+    seeds = pendingSeeds.get(key)
+    if not seeds:
+        return None
+    seed = seeds.pop(0)
+    if len(seeds) == 0:
+        del pendingSeeds[key]
+    return seed
+
+def resolveMember(ref, channel):
+    if "fake" in ref:
+        return getFakePlayer(ref["fake"], channel)
+    guild = getattr(channel, "guild", None)
+    member = guild.get_member(ref["id"]) if guild is not None else None
+    if member is None:
+        member = client.get_user(ref["id"])
+    return member
+
+class TimerHandle:
+    __slots__ = ("tick", "callback", "cancelled")
+    def __init__(self, tick, callback):
+        self.tick = tick
+        self.callback = callback
+        self.cancelled = False
+    def cancel(self):
+        self.cancelled = True
+
+class TimerWheel:
+    def __init__(self, tickInterval=1.0, slotCount=512):
+        self.tickInterval = tickInterval
+        self.slots = [[] for i in range(slotCount)]
+        self.currentTick = 0
+        self.task = None
+    def schedule(self, delay, callback):
+        ticks = max(1, int(-(-delay // self.tickInterval)))
+        handle = TimerHandle(self.currentTick + ticks, callback)
+        self.slots[handle.tick % len(self.slots)].append(handle)
+        return handle
+    def advance(self):
+        self.currentTick = self.currentTick + 1
+        index = self.currentTick % len(self.slots)
+        due = []
+        waiting = []
+        for handle in self.slots[index]:
+            if handle.cancelled:
+                continue
+            if handle.tick <= self.currentTick:
+                due.append(handle)
+            else:
+                waiting.append(handle)
+        self.slots[index] = waiting
+        for handle in due:
+            asyncio.ensure_future(self.fire(handle))
+    async def fire(self, handle):
+        try:
+            await handle.callback()
+        except Exception as e:
+            metrics.inc("timer_failures_total")
+            print(f'Timer callback {handle.callback!r} failed: {e!r}')
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        nextTick = loop.time()
+        while True:
+            nextTick = nextTick + self.tickInterval
+            await asyncio.sleep(max(0, nextTick - loop.time()))
+            self.advance()
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+timers = TimerWheel()
+promptTimeout = float(os.getenv('ROBBOT_PROMPT_TIMEOUT', '900'))
+idleTimeout = float(os.getenv('ROBBOT_IDLE_TIMEOUT', '7200'))
+anyChoice = object()
+deliveryPolicies = ("both", "channel", "dm", "digest")
+defaultDelivery = os.getenv('ROBBOT_DELIVERY', 'both')
+
+def doNothingCallback():
     return 0
 
-async def doNothingCallbackWithArgs(a, b):
+def doNothingCallbackWithArgs(a, b):
     return 0
 
 class PromptsBarrier:
-    def __init__(self, game, callback):
+    def __init__(self, game, callback, decided=None):
         self.prompts = []
         self.game = game
         self.count = 0
         self.callback = callback
+        self.decided = decided
+        self.phase = game.phaseName or callback.__name__
+        self.createdAt = time.perf_counter()
+        self.sentAt = None
     def addPrompt(self, prompt):
         self.prompts.append(prompt)
         self.prompts[-1].barrier = self
         self.count = self.count + 1
-    async def triggerPrompts(self):
+        routePrompt(prompt)
+        self.game.pendingDeadlines.append(prompt)
+        self.game.logEvent("prompt", m=memberRef(prompt.member), q=prompt.question)
+    def retire(self):
+        for prompt in self.prompts:
+            if not prompt.answered:
+                prompt.clearDeadline()
+    def triggerPrompts(self):
         for prompt in self.prompts:
-            await prompt.sendPrompt()
-    async def promptAnswered(self):
+            prompt.sendPrompt()
+    def promptSent(self, sentAt):
+        if self.sentAt is None and all(p.sentAt is not None for p in self.prompts):
+            self.sentAt = sentAt
+            self.game.traceSpan(timelineBotLane, "send " + self.phase, self.createdAt, sentAt, prompts=len(self.prompts))
+    def promptAnswered(self, answeredAt=None):
+        if answeredAt is None:
+            answeredAt = time.perf_counter()
         self.count = self.count - 1
+        if self.count > 0 and self.decided is not None and self.decided(self.count):
+            for prompt in self.prompts:
+                if not prompt.answered and isRouted(prompt):
+                    self.game.sendDM(prompt.member, "The vote was decided before your answer was needed")
+            self.retire()
+            self.count = 0
+            metrics.inc("ballots_closed_early_total", game=self.game.gameType())
         if(self.count == 0):
             if self.game.promptBarrier == self:
                 self.game.promptBarrier = None
-            await self.callback()
+            sentAt = self.sentAt if self.sentAt is not None else self.createdAt
+            self.game.traceSpan(timelinePhaseLane, self.phase, self.createdAt, answeredAt, send_ms=round((sentAt - self.createdAt) * 1000, 3), wait_ms=round((answeredAt - sentAt) * 1000, 3))
+            self.game.traceSpan(timelineHumanLane, "wait " + self.phase, sentAt, answeredAt)
+            self.callback()
+            self.game.traceSpan(timelineBotLane, "process " + self.phase, answeredAt, time.perf_counter())
 
 class Prompt:
     def __init__(self, game, question):
         self.answered = False
         self.game = game
         self.question = question
+        self.sentAt = None
+        self.deadline = None
     def setMember(self, member):
         self.member = member
-    async def sendPrompt(self):
-        await self.game.sendDM(member, self.question)
-
-def getClosestChoice(needle, haystack):
-    bestCount = 0
-    bestChoice = None
-    for h in haystack:
-        if needle == h:
+    def clearDeadline(self):
+        unroutePrompt(self)
+        if self.deadline is not None:
+            self.deadline.cancel()
+            self.deadline = None
+    async def expire(self):
+        #not acquire(), a timeout is not player activity and must not hold off idle expiry
+        async with self.game.lock:
+            if self.answered or not isRouted(self):
+                return
+            metrics.inc("prompt_timeouts_total", game=self.game.gameType())
+            self.timeOut()
+            deliveries = self.game.queueOutbound()
+        await fanOut(deliveries)
+    def timeOut(self):
+        self.game.sendDM(self.member, "You ran out of time, so you did not answer")
+        self.abstain()
+    def abstain(self):
+        self.game.logEvent("abstain", m=memberRef(self.member))
+        self.answered = True
+        self.clearDeadline()
+        self.barrier.promptAnswered()
+    def delivered(self, flush):
+        if self.sentAt is None and not flush.cancelled() and flush.exception() is None:
+            self.sentAt = time.perf_counter()
+            self.barrier.promptSent(self.sentAt)
+    def sendPrompt(self):
+        self.game.flushDigest(self.member)
+        self.game.sendDM(self.member, self.question, promptPriority, self)
+
+class PrefixIndex:
+    def __init__(self, choices):
+        self.exact = set(choices)
+        self.prefixes = dict()
+        for c in self.exact:
+            for i in range(len(c)):
+                prefix = c[:i]
+                if prefix in self.prefixes:
+                    self.prefixes[prefix] = None
+                else:
+                    self.prefixes[prefix] = c
+    def lookup(self, needle):
+        if needle in self.exact:
             return needle
-        if len(needle) < len(h):
-            if h.startswith(needle):
-                bestChoice = h
-                bestCount = bestCount + 1
-    if(bestCount > 1):
-        return None
-    return bestChoice
-        
+        return self.prefixes.get(needle)
 
 class ChoosePrompt(Prompt):
-    def __init__(self, game, exclude, question, choices, choiceLogic):
-        rm = [c.lower() for c in choices]
-        actualrm = []
-        for m in rm:
-            if m not in exclude:
-                actualrm.append(m)
-        self.choices = actualrm
+    def __init__(self, game, exclude, question, choices, choiceLogic, default=None):
+        excluded = set(e.lower() for e in exclude)
+        self.choices = [c.lower() for c in choices if c.lower() not in excluded]
+        self.index = PrefixIndex(self.choices)
         self.choiceLogic = choiceLogic
         Prompt.__init__(self, game, question)
-    async def sendPrompt(self):
-        await self.game.sendDM(self.member, self.question + "\n--CHOICES--\n" + ("\n".join(self.choices)))
-    async def answer(self, answer):
+        self.default = default
+    def sendPrompt(self):
+        self.game.flushDigest(self.member)
+        self.game.sendDM(self.member, self.question + "\n--CHOICES--\n" + ("\n".join(self.choices)), promptPriority, self)
+    def answer(self, answer):
         if(self.answered):
-            await self.game.sendDM(self.member, "You have already answered")
+            self.game.sendDM(self.member, "You have already answered")
             return
-        chosen = getClosestChoice(answer, [c.lower() for c in self.choices])
+        chosen = self.index.lookup(answer)
         if chosen is not None:
-            await self.game.sendDM(self.member, "Answer recieved")
-            await self.choiceLogic(self.member.name, chosen)
+            answeredAt = time.perf_counter()
+            if self.sentAt is not None:
+                self.game.traceSpan(self.game.getTimelineLane(self.member), "think " + self.barrier.phase, self.sentAt, answeredAt)
+            self.game.sendDM(self.member, "Answer recieved", chatterPriority)
+            self.game.logEvent("answer", m=memberRef(self.member), a=chosen)
+            if self.sentAt is not None:
+                metrics.observe("prompt_answer_seconds", time.perf_counter() - self.sentAt, game=self.game.gameType())
+            self.choiceLogic(self.member.name, chosen)
             self.answered = True
-            await self.barrier.promptAnswered()
+            self.clearDeadline()
+            self.barrier.promptAnswered(answeredAt)
+        else:
+            self.game.sendDM(self.member, "Your answer was not a valid choice", promptPriority)
+    def timeOut(self):
+        default = self.default
+        if default is anyChoice:
+            default = random.choice(self.choices) if len(self.choices) > 0 else None
+        if default is not None:
+            self.game.sendDM(self.member, "You ran out of time, so " + default + " was chosen for you")
+            self.answer(default)
         else:
-            await self.game.sendDM(self.member, "Your answer was not a valid choice")
+            Prompt.timeOut(self)
 
 class ChooseMemberPrompt(ChoosePrompt):
-    def __init__(self, game, exclude, question, choiceLogic):
-        ChoosePrompt.__init__(self, game, exclude, question, game.getMemberNames(), choiceLogic)
+    def __init__(self, game, exclude, question, choiceLogic, default=None):
+        ChoosePrompt.__init__(self, game, exclude, question, game.getMemberNames(), choiceLogic, default)
 
 class ChooseMemberInRolePrompt(ChoosePrompt):
-    def __init__(self, game, role, exclude, question, choiceLogic):
-        ChoosePrompt.__init__(self, game, exclude, question, game.getMemberNamesInRole(role), choiceLogic)
+    def __init__(self, game, role, exclude, question, choiceLogic, default=None):
+        ChoosePrompt.__init__(self, game, exclude, question, game.getMemberNamesInRole(role), choiceLogic, default)
 
 class YNPrompt(ChoosePrompt):
-    def __init__(self, game, question, choiceLogic):
-        ChoosePrompt.__init__(self, game, [], question, ["No", "Yes"], choiceLogic)
+    def __init__(self, game, question, choiceLogic, default="no"):
+        ChoosePrompt.__init__(self, game, [], question, ["No", "Yes"], choiceLogic, default)
+
+class Ballot:
+    def __init__(self, rng):
+        self.rng = rng
+        self.tallies = dict()
+        self.voters = dict()
+    def cast(self, voter, choice):
+        self.tallies[choice] = self.tallies.get(choice, 0) + 1
+        self.voters.setdefault(choice, []).append(voter)
+    def count(self, choice):
+        return self.tallies.get(choice, 0)
+    def settled(self, choice, needed, remaining):
+        count = self.count(choice)
+        return count >= needed or count + remaining < needed
+    def shuffledVoters(self, choice):
+        names = self.voters.get(choice, [])
+        self.rng.shuffle(names)
+        return names
+    def leaders(self):
+        top = max(self.tallies.values(), default=0)
+        return [choice for choice, count in self.tallies.items() if count == top and top > 0]
+    def results(self):
+        return "\n".join([choice + " has " + str(count) + " votes!" for choice, count in self.tallies.items()])
+
+class SendEffect:
+    __slots__ = ("channel", "member", "message", "priority", "prompt")
+    def __init__(self, channel, member, message, priority, prompt=None):
+        self.channel = channel
+        self.member = member
+        self.message = message
+        self.priority = priority
+        self.prompt = prompt
 
 class Game:
-    def __init__(self, channel_name):
-        self.members = set()
+    gameState = ()
+    usesTopics = False
+    def __init__(self, channel_name, seed=None):
+        self.members = dict()
+        self.rng = random.Random(seed)
         self.channel_name = channel_name
         self.channel = None
         self.roles = dict()
         self.promptBarrier = None
         self.gamePhase = 0
+        self.lock = asyncio.Lock()
+        self.effects = []
+        self.pendingDeadlines = []
+        self.sessionKey = None
+        self.replaying = False
+        self.running = False
+        self.delivery = defaultDelivery
+        self.deliveryOverrides = dict()
+        self.digests = dict()
+        self.phaseName = None
+        self.voteHistory = []
+        self.timelinePid = None
+        self.timelineLanes = dict()
+        self.lastActivity = time.monotonic()
     def addMember(self, member):
-        self.members.add(member)
+        self.members[member] = None
+        memberGames.setdefault(member, set()).add(self)
     def removeMember(self, member):
-        self.members.remove(member)
+        self.flushDigest(member)
+        self.deliveryOverrides.pop(member, None)
+        del self.members[member]
+        joined = memberGames[member]
+        joined.discard(self)
+        if len(joined) == 0:
+            del memberGames[member]
     def getMemberFromName(self, name):
         for m in self.members:
             if m.name.lower() == name.lower():
@@ -159,98 +871,255 @@ class Game:
         return [m.name for m in self.getMembersInRole(role)]
     def setChannel(self, channel):
         self.channel = channel
-    async def sendMessage(self, message):
-        await self.channel.send(message)
+    def gameType(self):
+        return type(self).__name__
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        start = time.perf_counter()
+        async with self.lock:
+            metrics.observe("lock_wait_seconds", time.perf_counter() - start, game=self.gameType())
+            self.lastActivity = time.monotonic()
+            yield
+    def getTimelineLane(self, member):
+        lane = self.timelineLanes.get(member)
+        if lane is None:
+            lane = timelineMemberLanes + len(self.timelineLanes)
+            self.timelineLanes[member] = lane
+            if timeline is not None:
+                timeline.nameLane(self, lane, member.name)
+        return lane
+    def traceSpan(self, lane, name, begin, end, **args):
+        if timeline is not None and not self.replaying:
+            timeline.span(self, lane, name, begin, end, **args)
+    def logEvent(self, event, **data):
+        if eventLog is not None and self.sessionKey is not None and not self.replaying:
+            data["s"] = list(self.sessionKey)
+            data["e"] = event
+            eventLog.append(data)
+    def start(self, channel, seed=None, topic=None):
+        if seed is None:
+            seed = takePendingSeed(self.sessionKey)
+        if seed is None:
+            seed = self.rng.getrandbits(32)
+        self.rng.seed(seed)
+        self.topic = topic
+        self.logEvent("start", seed=seed, topic=topic)
+        if traceLog is not None and self.sessionKey is not None and not self.replaying:
+            traceLog.append({"t": round(time.monotonic() - traceStart, 3), "k": "seed", "s": list(self.sessionKey), "seed": seed})
+        self.running = True
+        self.voteHistory = []
+        self.startGame(channel)
+    def finishGame(self, winner=None):
+        self.logEvent("closed", members=[memberRef(m) for m in self.members])
+        if statsStore is not None and not self.replaying:
+            statsStore.recordGame(self, winner)
+        self.releaseState()
+    def getRoleLabel(self, member):
+        return ",".join([str(r) for r in self.roles.get(member, [])])
+    def isWinner(self, member, winner):
+        return False
+    def recordBallot(self, kind):
+        ballotRound = len(self.voteHistory) and self.voteHistory[-1][0] + 1
+        for choice, voters in self.ballot.voters.items():
+            for voter in voters:
+                self.voteHistory.append((ballotRound, kind, voter, choice))
+    def releaseState(self):
+        self.flushDigests()
+        self.running = False
+        self.setPromptBarrier(None)
+        self.roles = dict()
+        self.voteHistory = []
+        for name in self.gameState:
+            self.__dict__.pop(name, None)
+    def teardown(self):
+        self.releaseState()
+        for m in list(self.members):
+            self.removeMember(m)
+        self.logEvent("closed", members=[])
+    def setPromptBarrier(self, pb):
+        if self.promptBarrier is not None and self.promptBarrier != pb:
+            self.promptBarrier.retire()
+        self.promptBarrier = pb
+    def getDelivery(self, member):
+        delivery = self.deliveryOverrides.get(member, self.delivery)
+        if delivery == "channel" and self.delivery == "dm":
+            return "dm"
+        return delivery
+    def sendMessage(self, message, priority=infoPriority):
+        if self.delivery != "dm":
+            self.sendMessageToChannel(self.channel, message, priority)
         for m in self.members:
             if not isinstance(m, FakePlayer):
-                await self.sendDM(m, message)
-    async def sendMessageToChannel(self, channel, message):
-        await channel.send(message)
-    async def sendDM(self, member, message):
-        print(member)
-        await member.create_dm()
-        await member.dm_channel.send(message)
-    async def sendPromptToAllWithRole(self, role, prompt, callback):
-        pb = PromptsBarrier(self, callback)
+                delivery = self.getDelivery(m)
+                if delivery == "digest":
+                    self.digests.setdefault(m, []).append(message)
+                elif delivery != "channel":
+                    self.sendDM(m, message, priority)
+    def flushDigest(self, member):
+        lines = self.digests.pop(member, None)
+        if lines is not None:
+            self.sendDM(member, "\n".join(lines))
+    def flushDigests(self):
+        for member in list(self.digests):
+            self.flushDigest(member)
+    def sendMessageToChannel(self, channel, message, priority=infoPriority):
+        if not self.replaying:
+            self.effects.append(SendEffect(channel, None, message, priority))
+    def sendDM(self, member, message, priority=infoPriority, prompt=None):
+        if not self.replaying:
+            self.effects.append(SendEffect(None, member, message, priority, prompt))
+    def takeEffects(self):
+        effects = self.effects
+        self.effects = []
+        return effects
+    def takeDeadlines(self):
+        prompts = self.pendingDeadlines
+        self.pendingDeadlines = []
+        return prompts
+    def armDeadlines(self):
+        for prompt in self.takeDeadlines():
+            if promptTimeout > 0 and not prompt.answered and isRouted(prompt):
+                prompt.deadline = timers.schedule(promptTimeout, prompt.expire)
+    def queueOutbound(self):
+        self.armDeadlines()
+        deliveries = dict()
+        for effect in self.takeEffects():
+            if effect.priority == chatterPriority and outbox.congested():
+                metrics.inc("outbound_shed_total", game=self.gameType())
+                continue
+            metrics.inc("outbound_messages_total", game=self.gameType(), kind="channel" if effect.member is None else "dm")
+            if effect.member is None:
+                deliveries[outbox.queue(effect.channel, effect.message, effect.priority)] = effect.channel
+            else:
+                flush = outbox.queueDM(effect.member, effect.message, effect.priority)
+                deliveries[flush] = effect.member
+                if effect.prompt is not None:
+                    flush.add_done_callback(effect.prompt.delivered)
+        return deliveries
+    def vote(self, whoVoted, votedFor):
+        self.ballot.cast(whoVoted, votedFor)
+    def sendPromptToAllWithRole(self, role, prompt, callback, decided=None):
+        pb = PromptsBarrier(self, callback, decided)
         for m in self.members:
             if role in self.roles[m]:
                 p = copy.copy(prompt)
                 p.setMember(m)
                 pb.addPrompt(p)
-        self.promptBarrier = pb
-        await pb.triggerPrompts()
-    async def sendPromptToAll(self, prompt, callback):
+        self.setPromptBarrier(pb)
+        pb.triggerPrompts()
+    def sendPromptToAll(self, prompt, callback):
         pb = PromptsBarrier(self, callback)
         for m in self.members:
             p = copy.copy(prompt)
             p.setMember(m)
             pb.addPrompt(p)
-        self.promptBarrier = pb
-        await pb.triggerPrompts()
-    async def sendPromptParasiteTo(self, member, prompt):
+        self.setPromptBarrier(pb)
+        pb.triggerPrompts()
+    def sendPromptParasiteTo(self, member, prompt):
         prompt.setMember(member)
         self.promptBarrier.addPrompt(prompt)
-        await prompt.sendPrompt()
-    async def sendPromptTo(self, member, prompt):
+        prompt.sendPrompt()
+    def sendPromptTo(self, member, prompt):
         pb = PromptsBarrier(self, doNothingCallback)
         prompt.setMember(member)
         pb.addPrompt(prompt)
-        self.promptBarrier = pb
-        await pb.triggerPrompts()
-    async def sendMessageToRole(self, role, message):
+        self.setPromptBarrier(pb)
+        pb.triggerPrompts()
+    def sendMessageToRole(self, role, message):
         roleMembers = self.getMembersInRole(role)
         for m in roleMembers:
-            await self.sendDM(m, message)
-    async def sendQueue(self, channel):
+            self.sendDM(m, message)
+    def sendQueue(self, channel):
         qu = '\n - '.join(self.getMemberNames())
-        await self.sendMessageToChannel(channel, "Queue:\n - " + qu)
+        self.sendMessageToChannel(channel, "Queue:\n - " + qu, chatterPriority)
     def assignRoles(self, roles):
-        random.shuffle(roles)
+        self.rng.shuffle(roles)
         i = 0
         for f in self.members:
             self.roles[f] = roles[i]
             i = i + 1
+        self.logEvent("roles", roles={f.name: self.roles[f] for f in self.members})
 
 class FakeArtistGame(Game):
     plainRole = 0
     fakerRole = 1
-    async def vote(self, whoVoted, votedFor):
-        if votedFor in self.fakerVotes:
-            self.fakerVotes[votedFor] = self.fakerVotes[votedFor] + 1
-        else:
-            self.fakerVotes[votedFor] = 1
-    async def startGame(self, channel):
+    gameState = ("ballot", "topic")
+    usesTopics = True
+    def startGame(self, channel):
         self.roles = dict()
-        self.fakerVotes = dict()
         self.setChannel(channel)
         self.gamePhase = 1
-        topicData = random.choice(topics)
-        category = topicData[0]
-        item = topicData[1]
+        category, item = self.topic
         currID = 0
         roles = ([self.plainRole] * (len(self.members) - 1)) + ([self.fakerRole])
         roles = [[r] for r in roles]
         self.assignRoles(roles)
-        await self.sendMessageToRole(self.plainRole, f'Category: {category}\nItem: {item}')
-        await self.sendMessageToRole(self.fakerRole, f'You are the faker!\nCategory: {category}\nItem: ???')
+        self.sendMessageToRole(self.plainRole, f'Category: {category}\nItem: {item}')
+        self.sendMessageToRole(self.fakerRole, f'You are the faker!\nCategory: {category}\nItem: ???')
         names = self.getMemberNames()
-        random.shuffle(names)
-        await self.sendMessage("Turn Order:\n" + "\n".join(names))
-    async def printOutResults(self):
-        votes = []
-        for key in self.fakerVotes:
-            votes.append(key + " has " + str(self.fakerVotes[key]) + " votes!")
-        await self.sendMessage("\n".join(votes))
-    async def endGame(self):
+        self.rng.shuffle(names)
+        self.sendMessage("Turn Order:\n" + "\n".join(names))
+    def getRoleLabel(self, member):
+        return "faker" if self.fakerRole in self.roles.get(member, []) else "artist"
+    def isWinner(self, member, winner):
+        return (winner == "faker") == (self.fakerRole in self.roles.get(member, []))
+    def printOutResults(self):
+        self.sendMessage(self.ballot.results())
+        self.recordBallot("accusation")
+        accused = self.ballot.leaders()
+        caught = len(accused) == 1 and self.fakerRole in self.roles.get(self.getMemberFromName(accused[0]), [])
+        self.finishGame("artists" if caught else "faker")
+    @phase
+    def endGame(self):
         self.gamePhase = 2
+        self.ballot = Ballot(self.rng)
         q = f'Please vote for one of the following: ' + ", ".join(self.getMemberNames()) + " by replying with the name"
-        await self.sendPromptToAll(ChooseMemberPrompt(self, [], q, self.vote), self.printOutResults)
+        self.sendPromptToAll(ChooseMemberPrompt(self, [], q, self.vote), self.printOutResults)
+
+class PolicyDeck:
+    __slots__ = ("fascist", "liberal", "top", "discardFascist", "discardLiberal", "rng")
+    def __init__(self, fascist, liberal, rng):
+        self.fascist = fascist
+        self.liberal = liberal
+        self.top = []
+        self.discardFascist = 0
+        self.discardLiberal = 0
+        self.rng = rng
+    def __len__(self):
+        return self.fascist + self.liberal + len(self.top)
+    def reveal(self, amount):
+        while len(self.top) < amount:
+            if self.rng.randrange(self.fascist + self.liberal) < self.fascist:
+                self.fascist = self.fascist - 1
+                self.top.append(1)
+            else:
+                self.liberal = self.liberal - 1
+                self.top.append(0)
+    def peekFascists(self, amount):
+        self.reveal(amount)
+        return sum(self.top[:amount])
+    def drawFascists(self, amount):
+        amountFascist = self.peekFascists(amount)
+        del self.top[:amount]
+        return amountFascist
+    def discard(self, amountFascist, amountLiberal):
+        self.discardFascist = self.discardFascist + amountFascist
+        self.discardLiberal = self.discardLiberal + amountLiberal
+    def reshuffle(self):
+        amountFascist = sum(self.top)
+        self.fascist = self.fascist + amountFascist + self.discardFascist
+        self.liberal = self.liberal + (len(self.top) - amountFascist) + self.discardLiberal
+        self.top = []
+        self.discardFascist = 0
+        self.discardLiberal = 0
 
 class SecretHitlerGame(Game):
     liberalRole = 0
     fascistRole = 1
     hitlerRole = 2
     aliveRole = 3
+    teamNames = {0: "liberal", 1: "fascist", 2: "hitler"}
+    gameState = ("deck", "turnOrder", "chancellor", "lastPresident", "lastChancellor", "ballot")
     def getTermLimited(self):
         if len(self.turnOrder) <= 5:
             if self.lastChancellor is None:
@@ -269,27 +1138,19 @@ class SecretHitlerGame(Game):
         if self.turnOrder[self.placardPosition].name not in base:
             base.append(self.turnOrder[self.placardPosition].name)
         return base
-    def vote(self, whoVoted, votedFor):
-        if votedFor in self.fakerVotes:
-            self.fakerVotes[votedFor] = self.fakerVotes[votedFor] + 1
-        else:
-            self.fakerVotes[votedFor] = 1
-    async def startGame(self, channel):
+    def startGame(self, channel):
         playerCount = len(self.members)
         self.lastChancellor = None
         self.lastPresident = None
         self.voteTracker = 0
         self.playerCount = playerCount
-        self.deck = ([self.fascistRole] * 11) + ([self.liberalRole] * 6)
-        self.discard = []
-        random.shuffle(self.deck)
+        self.deck = PolicyDeck(11, 6, self.rng)
         self.fascistPoliciesPassed = 0
         self.liberalPoliciesPassed = 0
         if(playerCount < 5 or playerCount > 10):
-            await self.sendMessageToChannel(channel, "Wrong amount of players")
+            self.sendMessageToChannel(channel, "Wrong amount of players")
             return
         self.roles = dict()
-        self.fakerVotes = dict()
         self.setChannel(channel)
         self.gamePhase = 1
         shouldInformHitler = False
@@ -302,115 +1163,123 @@ class SecretHitlerGame(Game):
             roles = ([self.liberalRole] * (playerCount - 4)) + ([self.fascistRole] * 3) + [self.hitlerRole]
         roles = [[r, self.aliveRole] for r in roles]
         self.assignRoles(roles)
-        await self.sendMessageToRole(self.liberalRole, f'You are a liberal')
+        self.sendMessageToRole(self.liberalRole, f'You are a liberal')
         fascInfo = self.getMemberNamesInRole(self.fascistRole)
         hitInfo = self.getMemberNamesInRole(self.hitlerRole)
         totalFascInfo = "--FASCISTS--\n" + ("\n".join(fascInfo)) + "\n--HITLER--\n" + hitInfo[0]
-        await self.sendMessageToRole(self.fascistRole, f'You are a fascist\n' + totalFascInfo)
+        self.sendMessageToRole(self.fascistRole, f'You are a fascist\n' + totalFascInfo)
         if(shouldInformHitler):
-            await self.sendMessageToRole(self.hitlerRole, f'You are the Secret Hitler\n' + totalFascInfo)
+            self.sendMessageToRole(self.hitlerRole, f'You are the Secret Hitler\n' + totalFascInfo)
         else:
-            await self.sendMessageToRole(self.hitlerRole, f'You are the Secret Hitler')
+            self.sendMessageToRole(self.hitlerRole, f'You are the Secret Hitler')
         players = list(self.members)
-        random.shuffle(players)
+        self.rng.shuffle(players)
         self.turnOrder = players
-        await self.sendMessage("Turn Order:\n" + "\n".join([m.name for m in self.turnOrder]))
+        self.sendMessage("Turn Order:\n" + "\n".join([m.name for m in self.turnOrder]))
         self.placardPosition = 0
-        await self.nominateChancellor()
-    async def refillDeck(self):
-        await self.sendMessage("Not enough cards, reshuffling in discard pile")
-        self.deck = self.deck + self.discard
-        self.discard = []
-        random.shuffle(self.deck)
-    async def presidentDeckInvestigation(self):
-        await self.sendMessage("The president gets to investigate the top three agendas of the deck!")
+        self.nominateChancellor()
+    def refillDeck(self):
+        self.sendMessage("Not enough cards, reshuffling in discard pile")
+        self.deck.reshuffle()
+    def presidentDeckInvestigation(self):
+        self.sendMessage("The president gets to investigate the top three agendas of the deck!")
         if(len(self.deck) < 3):
-            await self.refillDeck()
-        amountFascist = sum(self.deck[:3])
+            self.refillDeck()
+        amountFascist = self.deck.peekFascists(3)
         amountLiberal = 3 - amountFascist
-        await self.sendDM(self.turnOrder[self.placardPosition], "The top of the deck has " + str(amountFascist) + " fascist agendas and " + str(amountLiberal) + " liberal agendas.")
-        await self.passPlacard()
-    async def assassinate(self, voter, voted):
-        await self.sendMessage("The president has assassinated " + str(voted))
+        self.sendDM(self.turnOrder[self.placardPosition], "The top of the deck has " + str(amountFascist) + " fascist agendas and " + str(amountLiberal) + " liberal agendas.")
+        self.passPlacard()
+    def assassinate(self, voter, voted):
+        self.sendMessage("The president has assassinated " + str(voted))
         ind = 0
         for i in range(len(self.turnOrder)):
             if self.turnOrder[i].name == voted:
                 ind = i
         if(self.hitlerRole in self.roles[self.turnOrder[ind]]):
             self.sendMessage(self.turnOrder[ind].name + " who was just killed was the secret hitler so liberals win!")
+            self.finishGame("liberal")
             return
         self.roles[self.turnOrder[ind]].remove(self.aliveRole)
         del self.turnOrder[ind]
         if self.placardPosition > ind:
             self.placardPosition = self.placardPosition - 1
-        await self.sendMessage("Updated Turn Order:\n" + "\n".join([m.name for m in self.turnOrder]))
-        await self.passPlacard()
-    async def presidentShoot(self):
-        await self.sendPromptTo(self.chancellor, ChooseMemberInRolePrompt(self, self.aliveRole, [], "Who do you want to assassinate?", self.assassinate))
-    async def vetoYN(self, voter, voted):
+        self.sendMessage("Updated Turn Order:\n" + "\n".join([m.name for m in self.turnOrder]))
+        self.passPlacard()
+    @phase
+    def presidentShoot(self):
+        self.sendPromptTo(self.chancellor, ChooseMemberInRolePrompt(self, self.aliveRole, [], "Who do you want to assassinate?", self.assassinate, default=anyChoice))
+    def vetoYN(self, voter, voted):
         amountFascist = self.currentHandFascists
         amountLiberal = 2 - amountFascist
         if(voted == "yes"):
-            self.discard = self.discard + ([self.liberalRole] * amountLiberal) + ([self.fascistRole] * amountFascist)
-            await self.passPlacard()
+            self.deck.discard(amountFascist, amountLiberal)
+            self.passPlacard()
         else:
-            await self.cardPhaseChancellor(amountFascist, amountLiberal, False)
-    async def handleVeto(self):
-        await self.sendPromptTo(self.turnOrder[self.placardPosition], YNPrompt(self, "Would you like to accept the veto?", self.vetoYN))
-    async def playPolicyPhase(self, voter, voted):
+            self.cardPhaseChancellor(amountFascist, amountLiberal, False)
+    @phase
+    def handleVeto(self):
+        self.sendPromptTo(self.turnOrder[self.placardPosition], YNPrompt(self, "Would you like to accept the veto?", self.vetoYN))
+    def playPolicyPhase(self, voter, voted):
         if(voted == "veto"):
-            await self.handleVeto()
+            self.handleVeto()
             return
         elif(voted == "fascist"):
             self.currentHandFascists = self.currentHandFascists - 1
-            self.discard = self.discard + [self.fascistRole]
+            self.deck.discard(1, 0)
         else:
-            self.discard = self.discard + [self.liberalRole]
+            self.deck.discard(0, 1)
         if(self.currentHandFascists == 0):
             self.liberalPoliciesPassed = self.liberalPoliciesPassed + 1
-            await self.sendMessage("A liberal policy has been played")
-            await self.sendMessage("So far " + str(self.liberalPoliciesPassed) + " liberal policies have been passed and " + str(self.fascistPoliciesPassed) + " fascist policies have been passed.")
+            self.logEvent("policy", policy="liberal")
+            self.sendMessage("A liberal policy has been played")
+            self.sendMessage("So far " + str(self.liberalPoliciesPassed) + " liberal policies have been passed and " + str(self.fascistPoliciesPassed) + " fascist policies have been passed.")
             if(self.liberalPoliciesPassed == 5):
                 self.sendMessage("Liberals have won the game!")
+                self.finishGame("liberal")
             else:
-                await self.passPlacard()
+                self.passPlacard()
         else:
             self.fascistPoliciesPassed = self.fascistPoliciesPassed + 1
-            await self.sendMessage("A fascist policy has been played")
-            await self.sendMessage("So far " + str(self.liberalPoliciesPassed) + " liberal policies have been passed and " + str(self.fascistPoliciesPassed) + " fascist policies have been passed.")
+            self.logEvent("policy", policy="fascist")
+            self.sendMessage("A fascist policy has been played")
+            self.sendMessage("So far " + str(self.liberalPoliciesPassed) + " liberal policies have been passed and " + str(self.fascistPoliciesPassed) + " fascist policies have been passed.")
             if(self.fascistPoliciesPassed == 5):
-                await self.sendMessage("Veto power has been unlocked")
+                self.sendMessage("Veto power has been unlocked")
             if(self.playerCount <= 6):
                 if(self.fascistPoliciesPassed < 3):
-                    await self.passPlacard()
+                    self.passPlacard()
                 elif(self.fascistPoliciesPassed == 3):
-                    await self.presidentDeckInvestigation()
+                    self.presidentDeckInvestigation()
                 elif(self.fascistPoliciesPassed < 6):
-                    await self.presidentShoot()
+                    self.presidentShoot()
                 else:
-                    await self.sendMessage("Fascists have won the game!")
+                    self.sendMessage("Fascists have won the game!")
+                    self.finishGame("fascist")
             elif(self.playerCount <= 8):
                 if(self.fascistPoliciesPassed == 1):
-                    await self.passPlacard()
+                    self.passPlacard()
                 elif(self.fascistPoliciesPassed == 2):
-                    await self.presidentPlayerInvestigation()
+                    self.presidentPlayerInvestigation()
                 elif(self.fascistPoliciesPassed == 3):
-                    await self.presidentChooseNextPresident()
+                    self.presidentChooseNextPresident()
                 elif(self.fascistPoliciesPassed < 6):
-                    await self.presidentShoot()
+                    self.presidentShoot()
                 else:
-                    await self.sendMessage("Fascists have won the game!")
+                    self.sendMessage("Fascists have won the game!")
+                    self.finishGame("fascist")
             else:
                 if(self.fascistPoliciesPassed < 3):
-                    await self.presidentPlayerInvestigation()
+                    self.presidentPlayerInvestigation()
                 elif(self.fascistPoliciesPassed == 3):
-                    await self.presidentChooseNextPresident()
+                    self.presidentChooseNextPresident()
                 elif(self.fascistPoliciesPassed < 6):
-                    await self.presidentShoot()
+                    self.presidentShoot()
                 else:
-                    await self.sendMessage("Fascists have won the game!")
+                    self.sendMessage("Fascists have won the game!")
+                    self.finishGame("fascist")
                 
-    async def cardPhaseChancellor(self, amountFascist, amountLiberal, canVeto):
+    @phase
+    def cardPhaseChancellor(self, amountFascist, amountLiberal, canVeto):
         choices = []
         if(amountFascist > 0):
             choices.append("fascist")
@@ -419,22 +1288,21 @@ class SecretHitlerGame(Game):
         if(canVeto):
             choices.append("veto")
         ptext = "You were given " + str(amountFascist) + " fascist agendas and " + str(amountLiberal) + " liberal agendas. What would you like to discard?"
-        await self.sendPromptTo(self.chancellor, ChoosePrompt(self, [], ptext, choices, self.playPolicyPhase))
-    async def cardDiscardPhasePresident(self, voter, voted):
+        self.sendPromptTo(self.chancellor, ChoosePrompt(self, [], ptext, choices, self.playPolicyPhase, default=anyChoice))
+    def cardDiscardPhasePresident(self, voter, voted):
         if(voted == "fascist"):
             self.currentHandFascists = self.currentHandFascists - 1
-            self.discard = self.discard + [self.fascistRole]
+            self.deck.discard(1, 0)
         else:
-            self.discard = self.discard + [self.liberalRole]
+            self.deck.discard(0, 1)
         amountFascist = self.currentHandFascists
         amountLiberal = 2 - amountFascist
-        await self.cardPhaseChancellor(amountFascist, amountLiberal, self.fascistPoliciesPassed == 5)
-    async def cardPhasePresident(self):
+        self.cardPhaseChancellor(amountFascist, amountLiberal, self.fascistPoliciesPassed == 5)
+    @phase
+    def cardPhasePresident(self):
         if(len(self.deck) < 3):
-            await self.refillDeck()
-        choices = self.deck[:3]
-        self.deck = self.deck[3:]
-        amountFascist = sum(choices)
+            self.refillDeck()
+        amountFascist = self.deck.drawFascists(3)
         self.currentHandFascists = amountFascist
         amountLiberal = 3 - amountFascist
         choices = []
@@ -443,79 +1311,94 @@ class SecretHitlerGame(Game):
         if(amountLiberal > 0):
             choices.append("liberal")
         ptext = "You drew " + str(amountFascist) + " fascist agendas and " + str(amountLiberal) + " liberal agendas. What would you like to discard?"
-        await self.sendPromptTo(self.turnOrder[self.placardPosition], ChoosePrompt(self, [], ptext, choices, self.cardDiscardPhasePresident))
-    async def acceptNominationYN(self, voter, voted):
-        print("Dealing with YN Nomination")
-        if(voted == "yes"):
-            self.yesAmount = self.yesAmount + 1
-            self.yesNames = self.yesNames + [voter]
-        else:
-            self.noNames = self.noNames + [voter]
-        random.shuffle(self.yesNames)
-        random.shuffle(self.noNames)
-    async def finishNomination(self):
-        yesVotes = self.yesAmount
-        noVotes = len(self.turnOrder) - yesVotes
-        voteData = "Yes: " + (", ".join(self.yesNames)) + "\nNo: " + (", ".join(self.noNames))
-        if(self.yesAmount > (len(self.turnOrder) // 2)):
+        self.sendPromptTo(self.turnOrder[self.placardPosition], ChoosePrompt(self, [], ptext, choices, self.cardDiscardPhasePresident, default=anyChoice))
+    def electionSettled(self, remaining):
+        return self.ballot.settled("yes", (len(self.turnOrder) // 2) + 1, remaining)
+    def getRoleLabel(self, member):
+        return ",".join([self.teamNames[r] for r in self.roles.get(member, []) if r in self.teamNames])
+    def isWinner(self, member, winner):
+        roles = self.roles.get(member, [])
+        if winner == "liberal":
+            return self.liberalRole in roles
+        return self.fascistRole in roles or self.hitlerRole in roles
+    def finishNomination(self):
+        self.recordBallot("election")
+        self.resolveNomination()
+        self.flushDigests()
+    def resolveNomination(self):
+        yesVotes = self.ballot.count("yes")
+        noVotes = self.ballot.count("no")
+        voteData = "Yes: " + (", ".join(self.ballot.shuffledVoters("yes"))) + "\nNo: " + (", ".join(self.ballot.shuffledVoters("no")))
+        if(yesVotes > (len(self.turnOrder) // 2)):
             #vote passes
             self.lastPresident = self.turnOrder[self.placardPosition]
             self.lastChancellor = self.chancellor
-            await self.sendMessage("Vote passed! There were " + str(yesVotes) + " votes for yes and " + str(noVotes) + " votes for no.\n" + voteData)
+            self.sendMessage("Vote passed! There were " + str(yesVotes) + " votes for yes and " + str(noVotes) + " votes for no.\n" + voteData)
             if(self.fascistPoliciesPassed >= 3):
                 if(self.hitlerRole in self.roles[self.chancellor]):
-                    await self.sendMessage("You have elected the secret hitler " + self.chancellor.name + " as chancellor, fascists win!")
+                    self.sendMessage("You have elected the secret hitler " + self.chancellor.name + " as chancellor, fascists win!")
+                    self.finishGame("fascist")
                     return
                 else:
-                    await self.sendMessage(self.chancellor.name + " is not the secret hitler.")
-            await self.cardPhasePresident()
+                    self.sendMessage(self.chancellor.name + " is not the secret hitler.")
+            self.cardPhasePresident()
         else:
             #vote fails
             self.voteTracker = self.voteTracker + 1
-            await self.sendMessage("Vote failed! There were " + str(yesVotes) + " votes for yes and " + str(noVotes) + " votes for no.\n" + voteData)
-            await self.sendMessage("VOTE FAILED")
+            self.sendMessage("Vote failed! There were " + str(yesVotes) + " votes for yes and " + str(noVotes) + " votes for no.\n" + voteData)
+            self.sendMessage("VOTE FAILED")
             if self.voteTracker == 3:
                 self.lastPresident = None
                 self.lastChancellor = None
                 self.voteTracker = 0
                 if(len(self.deck) < 1):
-                    await self.refillDeck()
-                chosen = self.deck[0]
-                self.deck = self.deck[1:]
-                await self.sendMessage("The populace is angry and riot to play an agenda of their own")
-                if(chosen == self.fascistRole):
+                    self.refillDeck()
+                chosenFascist = self.deck.drawFascists(1)
+                self.sendMessage("The populace is angry and riot to play an agenda of their own")
+                if(chosenFascist == 1):
                     self.fascistPoliciesPassed = self.fascistPoliciesPassed + 1
-                    await self.sendMessage("A fascist policy has been played")
-                    await self.sendMessage("So far " + str(self.liberalPoliciesPassed) + " liberal policies have been passed and " + str(self.fascistPoliciesPassed) + " fascist policies have been passed.")
+                    self.logEvent("policy", policy="fascist", riot=True)
+                    self.sendMessage("A fascist policy has been played")
+                    self.sendMessage("So far " + str(self.liberalPoliciesPassed) + " liberal policies have been passed and " + str(self.fascistPoliciesPassed) + " fascist policies have been passed.")
                     if(self.fascistPoliciesPassed == 6):
-                        await self.sendMessage("Fascists have won the game!")
+                        self.sendMessage("Fascists have won the game!")
+                        self.finishGame("fascist")
                     else:
-                        await self.passPlacard()
+                        self.passPlacard()
                 else:
                     self.liberalPoliciesPassed = self.liberalPoliciesPassed + 1
-                    await self.sendMessage("A liberal policy has been played")
-                    await self.sendMessage("So far " + str(self.liberalPoliciesPassed) + " liberal policies have been passed and " + str(self.fascistPoliciesPassed) + " fascist policies have been passed.")
+                    self.logEvent("policy", policy="liberal", riot=True)
+                    self.sendMessage("A liberal policy has been played")
+                    self.sendMessage("So far " + str(self.liberalPoliciesPassed) + " liberal policies have been passed and " + str(self.fascistPoliciesPassed) + " fascist policies have been passed.")
                     if(self.liberalPoliciesPassed == 5):
                         self.sendMessage("Liberals have won the game!")
+                        self.finishGame("liberal")
             else:
-                await self.sendMessage("Vote tracker is at " + str(self.voteTracker))
-                await self.passPlacard()
+                self.sendMessage("Vote tracker is at " + str(self.voteTracker))
+                self.passPlacard()
                 
-    async def votePhase(self, voter, voted):
+    @phase
+    def votePhase(self, voter, voted):
         self.chancellor = self.getMemberFromName(voted)
-        await self.sendMessage(self.chancellor.name + " was nominated for Chancellor!")
-        self.yesAmount = 0
-        self.yesNames = []
-        self.noNames = []
-        await self.sendPromptToAllWithRole(self.aliveRole, YNPrompt(self, "Do you accept the nomination of " + self.chancellor.name + " for chancellor?", self.acceptNominationYN), self.finishNomination)
-    async def nominateChancellor(self):
-        await self.sendPromptTo(self.turnOrder[self.placardPosition], ChooseMemberInRolePrompt(self, self.aliveRole, self.getNonChancellorable(), "Who would you like to nominate as chancellor?", self.votePhase))
-    async def passPlacard(self):
+        self.sendMessage(self.chancellor.name + " was nominated for Chancellor!")
+        self.ballot = Ballot(self.rng)
+        self.sendPromptToAllWithRole(self.aliveRole, YNPrompt(self, "Do you accept the nomination of " + self.chancellor.name + " for chancellor?", self.vote), self.finishNomination, self.electionSettled)
+    @phase
+    def nominateChancellor(self):
+        self.sendPromptTo(self.turnOrder[self.placardPosition], ChooseMemberInRolePrompt(self, self.aliveRole, self.getNonChancellorable(), "Who would you like to nominate as chancellor?", self.votePhase, default=anyChoice))
+    def passPlacard(self):
         self.placardPosition = (self.placardPosition + 1) % len(self.turnOrder)
-        await self.nominateChancellor()
-    async def endGame(self):
+        self.nominateChancellor()
+    def endGame(self):
         pass
 
+class NightAction:
+    def __init__(self, role, actor, kind):
+        self.role = role
+        self.actor = actor
+        self.kind = kind
+        self.targets = []
+
 class OneNightWerewolfGame(Game):
     villagerRole = 0
     werewolfRole = 1
@@ -523,199 +1406,228 @@ class OneNightWerewolfGame(Game):
     seerRole = 3
     robberRole = 4
     troubleMakerRole = 5
+    gameState = ("deck", "middleCards", "players", "seats", "playersByRole", "nightActions", "ballot")
+    roleNames = {villagerRole: "Villager", werewolfRole: "Werewolf", minionRole: "Minion", seerRole: "Seer", robberRole: "Robber", troubleMakerRole: "Troublemaker"}
+    middlePositions = {"left": -3, "middle": -2, "right": -1}
+    nightPrompts = {
+        villagerRole: ("You are a villager, what would you like to do during the night phase?", ["Nothing"], None),
+        werewolfRole: ("You are a werewolf, what would you like to do during the night phase?", ["Nothing"], None),
+        minionRole: ("You are the minion, what would you like to do during the night phase?", ["Nothing"], None),
+        seerRole: ("You are the seer, would you like to look at a player card, look at two middle cards, or do nothing?", ["Player", "Middle", "Nothing"], "seerCallback"),
+        robberRole: ("You are the robber, would you like to steal a card or do nothing?", ["Steal", "Nothing"], "robberCallback"),
+        troubleMakerRole: ("You are the troublemaker, would you like to swap cards or do nothing?", ["Swap", "Nothing"], "troubleCallback"),
+    }
+    nightInfo = [(werewolfRole, "--WEREWOLVES--", [werewolfRole, minionRole])]
+    nightResolvers = [(seerRole, "resolveSeer"), (robberRole, "resolveRobber"), (troubleMakerRole, "resolveTroubleMaker")]
     def getRoleName(self, role):
-        if(role == self.villagerRole):
-            return "Villager"
-        elif(role == self.werewolfRole):
-            return "Werewolf"
-        elif(role == self.minionRole):
-            return "Minion"
-        elif(role == self.seerRole):
-            return "Seer"
-        elif(role == self.robberRole):
-            return "Robber"
-        elif(role == self.troubleMakerRole):
-            return "Troublemaker"
-        return "Unknown"
+        return self.roleNames.get(role, "Unknown")
     def getPlayerIndex(self, name):
-        ind = 0
-        for p in self.players:
-            if p.name == name:
-                return ind
-            ind = ind + 1
-        return -1
+        return self.seats.get(name.lower(), -1)
+    def getPlayer(self, name):
+        return self.players[self.seats[name.lower()]]
     def getMiddleIndex(self, pos):
-        if pos.lower() == "left":
-            return -3
-        elif pos.lower() == "middle":
-            return -2
-        return -1
-    async def printDeck(self):
+        return self.middlePositions.get(pos.lower(), -1)
+    def printDeck(self):
         data = "--PLAYER CARDS--\n"
         data = data + ("\n".join([(self.players[i].name + ": " + self.getRoleName(self.deck[i])) for i in range(len(self.players))]))
         data = data + "\n--MIDDLE CARDS--\n"
         data = data + "Left: " + self.getRoleName(self.deck[-3]) + "\n"
         data = data + "Middle: " + self.getRoleName(self.deck[-2]) + "\n"
         data = data + "Right: " + self.getRoleName(self.deck[-1])
-        await self.sendMessage(data)
-    async def seerPlayerCallback(self, voter, voted):
-        self.seerActionType = 'P'
-        self.seerAction1 = voted
-    async def seerMiddleCallback(self, voter, voted):
-        seer = self.getMemberFromName(voter)
-        self.seerActionType = 'M'
-        self.seerAction1 = voted
-        await self.sendPromptParasiteTo(seer, ChoosePrompt(self, [self.seerAction1], "Which middle card would you like to see second?", ["Left", "Middle", "Right"], self.seerMiddleSecondCallback))
-    async def seerMiddleSecondCallback(self, voter, voted):
-        self.seerAction2 = voted
-    async def seerCallback(self, voter, voted):
-        seer = self.getMemberFromName(voter)
-        self.seer = seer
+        self.sendMessage(data)
+    def beginNightAction(self, role, voter, kind):
+        actor = self.getPlayer(voter)
+        self.nightActions[actor] = NightAction(role, actor, kind)
+        return actor
+    def addNightTarget(self, voter, voted):
+        self.nightActions[self.getPlayer(voter)].targets.append(voted)
+    def seerCallback(self, voter, voted):
         if(voted == "player"):
-            await self.sendPromptParasiteTo(seer, ChooseMemberPrompt(self, [voter], "Whose card would you like to see?", self.seerPlayerCallback))
+            seer = self.beginNightAction(self.seerRole, voter, voted)
+            self.sendPromptParasiteTo(seer, ChooseMemberPrompt(self, [voter], "Whose card would you like to see?", self.addNightTarget, default=anyChoice))
         elif(voted == "middle"):
-            await self.sendPromptParasiteTo(seer, ChoosePrompt(self, [], "Which middle card would you like to see first?", ["Left", "Middle", "Right"], self.seerMiddleCallback))
-        else:
-            pass
-    async def robberCallback(self, voter, voted):
-        robber = self.getMemberFromName(voter)
-        self.robber = robber
+            seer = self.beginNightAction(self.seerRole, voter, voted)
+            self.sendPromptParasiteTo(seer, ChoosePrompt(self, [], "Which middle card would you like to see first?", ["Left", "Middle", "Right"], self.seerMiddleCallback, default=anyChoice))
+    def seerMiddleCallback(self, voter, voted):
+        self.addNightTarget(voter, voted)
+        self.sendPromptParasiteTo(self.getPlayer(voter), ChoosePrompt(self, [voted], "Which middle card would you like to see second?", ["Left", "Middle", "Right"], self.addNightTarget, default=anyChoice))
+    def robberCallback(self, voter, voted):
         if(voted == "steal"):
-            await self.sendPromptParasiteTo(robber, ChooseMemberPrompt(self, [voter], "Whose card would you like to steal?", self.robberSecondCallback))
-        else:
-            pass
-    async def robberSecondCallback(self, voter, voted):
-        self.robberAction = voted
-    async def troubleCallback(self, voter, voted):
-        troubleMaker = self.getMemberFromName(voter)
-        self.troubleMaker = troubleMaker
+            robber = self.beginNightAction(self.robberRole, voter, voted)
+            self.sendPromptParasiteTo(robber, ChooseMemberPrompt(self, [voter], "Whose card would you like to steal?", self.addNightTarget))
+    def troubleCallback(self, voter, voted):
         if(voted == "swap"):
-            await self.sendPromptParasiteTo(troubleMaker, ChooseMemberPrompt(self, [voter], "Whose card would you like to swap first?", self.troubleSecondCallback))
-        else:
-            pass
-    async def troubleSecondCallback(self, voter, voted):
-        troubleMaker = self.getMemberFromName(voter)
-        self.troubleMakerAction1 = voted
-        await self.sendPromptParasiteTo(troubleMaker, ChooseMemberPrompt(self, [voter, voted], "Whose card would you like to swap it with?", self.troubleThirdCallback))
-    async def troubleThirdCallback(self, voter, voted):
-        troubleMaker = self.getMemberFromName(voter)
-        self.troubleMakerAction2 = voted
-    async def nightPhase(self):
+            troubleMaker = self.beginNightAction(self.troubleMakerRole, voter, voted)
+            self.sendPromptParasiteTo(troubleMaker, ChooseMemberPrompt(self, [voter], "Whose card would you like to swap first?", self.troubleSecondCallback))
+    def troubleSecondCallback(self, voter, voted):
+        self.addNightTarget(voter, voted)
+        self.sendPromptParasiteTo(self.getPlayer(voter), ChooseMemberPrompt(self, [voter, voted], "Whose card would you like to swap it with?", self.addNightTarget, default=anyChoice))
+    @phase
+    def nightPhase(self):
+        for revealedRole, header, recipientRoles in self.nightInfo:
+            info = header + "\n" + ("\n".join([m.name for m in self.playersByRole.get(revealedRole, [])]))
+            for role in recipientRoles:
+                for m in self.playersByRole.get(role, []):
+                    self.sendDM(m, info)
         pb = PromptsBarrier(self, self.nightPhaseFinish)
-        for m in self.members:
-            if self.villagerRole in self.roles[m]:
-                p = ChoosePrompt(self, [], "You are a villager, what would you like to do during the night phase?", ["Nothing"], doNothingCallbackWithArgs)
-                p.setMember(m)
-                pb.addPrompt(p)
-            if self.werewolfRole in self.roles[m]:
-                ww = self.getMemberNamesInRole(self.werewolfRole)
-                await self.sendMessageToRole(self.werewolfRole, "--WEREWOLVES--\n" + ("\n".join(ww)))
-                p = ChoosePrompt(self, [], "You are a werewolf, what would you like to do during the night phase?", ["Nothing"], doNothingCallbackWithArgs)
-                p.setMember(m)
-                pb.addPrompt(p)
-            if self.minionRole in self.roles[m]:
-                await self.sendMessageToRole(self.minionRole, "--WEREWOLVES--\n" + ("\n".join(self.getMemberNamesInRole(self.werewolfRole))))
-                p = ChoosePrompt(self, [], "You are the minion, what would you like to do during the night phase?", ["Nothing"], doNothingCallbackWithArgs)
-                p.setMember(m)
-                pb.addPrompt(p)
-            if self.seerRole in self.roles[m]:
-                p = ChoosePrompt(self, [], "You are the seer, would you like to look at a player card, look at two middle cards, or do nothing?", ["Player", "Middle", "Nothing"], self.seerCallback)
-                p.setMember(m)
-                pb.addPrompt(p)
-            if self.robberRole in self.roles[m]:
-                p = ChoosePrompt(self, [], "You are the robber, would you like to steal a card or do nothing?", ["Steal", "Nothing"], self.robberCallback)
-                p.setMember(m)
-                pb.addPrompt(p)
-            if self.troubleMakerRole in self.roles[m]:
-                p = ChoosePrompt(self, [], "You are the troublemaker, would you like to swap cards or do nothing?", ["Swap", "Nothing"], self.troubleCallback)
-                p.setMember(m)
-                pb.addPrompt(p)
-        self.promptBarrier = pb
-        await pb.triggerPrompts()
-    async def nightPhaseFinish(self):
-        seerData = "--SEER--\n" + str([self.seerActionType, self.seerAction1, self.seerAction2])
-        robberData = "--ROBBER--\n" + str([self.robberAction])
-        troubleMakerData = "--TROUBLEMAKER--\n" + str([self.troubleMakerAction1, self.troubleMakerAction2])
-        #await self.printDeck()
-        if(self.seerActionType is not None):
-            if(self.seerActionType == 'P'):
-                pindex = self.getPlayerIndex(self.seerAction1)
-                cardData = self.getRoleName(self.deck[pindex])
-                await self.sendDM(self.seer, self.players[pindex].name + " had the " + cardData + " role!")
-            else:
-                index1 = self.getMiddleIndex(self.seerAction1)
-                index2 = self.getMiddleIndex(self.seerAction2)
-                cardData1 = self.getRoleName(self.deck[index1])
-                cardData2 = self.getRoleName(self.deck[index2])
-                await self.sendDM(self.seer, self.seerAction1 + " had the " + cardData1 + " role and " + self.seerAction2 + " had the " + cardData2 + " role!")
-        #await self.printDeck()
-        if(self.robberAction is not None):
-            robbedIndex = self.getPlayerIndex(self.robberAction)
-            robberIndex = self.getPlayerIndex(self.robber.name)
-            temp = self.deck[robbedIndex]
-            self.deck[robbedIndex] = self.deck[robberIndex]
-            self.deck[robberIndex] = temp
-            await self.sendDM(self.robber, "You robbed the " + self.getRoleName(self.deck[robberIndex]) + " role from " + self.players[robbedIndex].name + "!")
-        #await self.printDeck()
-        if(self.troubleMakerAction1 is not None):
-            tindex1 = self.getPlayerIndex(self.troubleMakerAction1)
-            tindex2 = self.getPlayerIndex(self.troubleMakerAction2)
-            temp = self.deck[tindex1]
-            self.deck[tindex1] = self.deck[tindex2]
-            self.deck[tindex2] = temp
-            await self.sendDM(self.troubleMaker, "You swapped cards between " + self.players[tindex1].name + " and " + self.players[tindex2].name + "!")
-        await self.sendMessage("The Night Phase has been finished")
-        #await self.printDeck()
-    async def startGame(self, channel):
+        for i in range(len(self.players)):
+            question, choices, callbackName = self.nightPrompts[self.deck[i]]
+            callback = getattr(self, callbackName) if callbackName is not None else doNothingCallbackWithArgs
+            p = ChoosePrompt(self, [], question, choices, callback, default="nothing")
+            p.setMember(self.players[i])
+            pb.addPrompt(p)
+        self.setPromptBarrier(pb)
+        pb.triggerPrompts()
+    def resolveSeer(self, action):
+        if(action.kind == "player" and len(action.targets) == 1):
+            pindex = self.getPlayerIndex(action.targets[0])
+            self.sendDM(action.actor, self.players[pindex].name + " had the " + self.getRoleName(self.deck[pindex]) + " role!")
+        elif(action.kind == "middle" and len(action.targets) == 2):
+            first = action.targets[0]
+            second = action.targets[1]
+            cardData1 = self.getRoleName(self.deck[self.getMiddleIndex(first)])
+            cardData2 = self.getRoleName(self.deck[self.getMiddleIndex(second)])
+            self.sendDM(action.actor, first + " had the " + cardData1 + " role and " + second + " had the " + cardData2 + " role!")
+    def resolveRobber(self, action):
+        if(len(action.targets) == 1):
+            robbedIndex = self.getPlayerIndex(action.targets[0])
+            robberIndex = self.getPlayerIndex(action.actor.name)
+            self.deck[robbedIndex], self.deck[robberIndex] = self.deck[robberIndex], self.deck[robbedIndex]
+            self.sendDM(action.actor, "You robbed the " + self.getRoleName(self.deck[robberIndex]) + " role from " + self.players[robbedIndex].name + "!")
+    def resolveTroubleMaker(self, action):
+        if(len(action.targets) == 2):
+            tindex1 = self.getPlayerIndex(action.targets[0])
+            tindex2 = self.getPlayerIndex(action.targets[1])
+            self.deck[tindex1], self.deck[tindex2] = self.deck[tindex2], self.deck[tindex1]
+            self.sendDM(action.actor, "You swapped cards between " + self.players[tindex1].name + " and " + self.players[tindex2].name + "!")
+    def nightPhaseFinish(self):
+        actionsByRole = dict()
+        for action in self.nightActions.values():
+            actionsByRole.setdefault(action.role, []).append(action)
+        for role, resolverName in self.nightResolvers:
+            for action in actionsByRole.get(role, []):
+                getattr(self, resolverName)(action)
+        self.sendMessage("The Night Phase has been finished")
+        self.flushDigests()
+    def startGame(self, channel):
         self.roles = dict()
-        self.fakerVotes = dict()
         self.setChannel(channel)
         self.players = list(self.members)
+        self.seats = {self.players[i].name.lower(): i for i in range(len(self.players))}
+        self.nightActions = dict()
         cardsNeeded = len(self.members) + 3
-        self.seer = None
-        self.seerActionType = None
-        self.seerAction1 = None
-        self.seerAction2 = None
-        self.robber = None
-        self.robberAction = None
-        self.troubleMaker = None
-        self.troubleMakerAction1 = None
-        self.troubleMakerAction2 = None
         self.deck = ([self.werewolfRole] * 2) + [self.seerRole, self.robberRole, self.troubleMakerRole, self.villagerRole]
         if(cardsNeeded >= 7):
             self.deck = self.deck + [self.villagerRole]
         if(cardsNeeded >= 8):
             self.deck = self.deck + [self.villagerRole]
-        random.shuffle(self.deck)
+        self.rng.shuffle(self.deck)
         self.middleCards = [self.deck[-3], self.deck[-2], self.deck[-1]]
+        self.playersByRole = dict()
         for i in range(len(self.players)):
             self.roles[self.players[i]] = [self.deck[i]]
-        await self.nightPhase()
-    async def vote(self, whoVoted, votedFor):
-        if votedFor in self.fakerVotes:
-            self.fakerVotes[votedFor] = self.fakerVotes[votedFor] + 1
-        else:
-            self.fakerVotes[votedFor] = 1
-    async def printOutResults(self):
-        votes = []
-        for key in self.fakerVotes:
-            votes.append(key + " has " + str(self.fakerVotes[key]) + " votes!")
-        await self.sendMessage("\n".join(votes))
-        await self.printDeck()
-    async def endGame(self):
+            self.playersByRole.setdefault(self.deck[i], []).append(self.players[i])
+        self.logEvent("roles", roles={p.name: self.roles[p] for p in self.players})
+        self.nightPhase()
+    def getRoleLabel(self, member):
+        return self.getRoleName(self.roles[member][0]) if member in self.roles else ""
+    def getTeam(self, role):
+        return "werewolves" if role == self.werewolfRole or role == self.minionRole else "village"
+    def isWinner(self, member, winner):
+        seat = self.getPlayerIndex(member.name)
+        return seat >= 0 and self.getTeam(self.deck[seat]) == winner
+    def printOutResults(self):
+        self.sendMessage(self.ballot.results())
+        self.printDeck()
+        self.recordBallot("accusation")
+        killed = self.ballot.leaders() if max(self.ballot.tallies.values(), default=0) > 1 else []
+        killedWerewolf = any(self.getPlayerIndex(name) >= 0 and self.deck[self.getPlayerIndex(name)] == self.werewolfRole for name in killed)
+        werewolvesPlaying = any(self.deck[i] == self.werewolfRole for i in range(len(self.players)))
+        villageWins = killedWerewolf or (not werewolvesPlaying and len(killed) == 0)
+        self.finishGame("village" if villageWins else "werewolves")
+    @phase
+    def endGame(self):
         self.gamePhase = 2
+        self.ballot = Ballot(self.rng)
         q = f'Please vote for one of the following: ' + ", ".join(self.getMemberNames()) + " by replying with the name"
-        await self.sendPromptToAll(ChooseMemberPrompt(self, [], q, self.vote), self.printOutResults)
+        self.sendPromptToAll(ChooseMemberPrompt(self, [], q, self.vote), self.printOutResults)
 
-games = [OneNightWerewolfGame("one-night-werewolf"), FakeArtistGame("fake-artist"), SecretHitlerGame("secret-hitler")]
+gameTypes = {"one-night-werewolf": OneNightWerewolfGame, "fake-artist": FakeArtistGame, "secret-hitler": SecretHitlerGame}
+sessions = dict()
 
-topics = []
+def getSessionKey(channel):
+    guild = getattr(channel, "guild", None)
+    return (guild.id if guild is not None else None, channel.id)
 
-with open('words.csv', newline='') as csvfile:
-    spamreader = csv.reader(csvfile, delimiter=',', quotechar='|')
-    for row in spamreader:
-        topics.append((row[0], row[1]))
-print(topics)
+def getGame(channel):
+    key = getSessionKey(channel)
+    game = sessions.get(key)
+    if game is None:
+        gameType = gameTypes.get(channel.name)
+        if gameType is None:
+            return None
+        game = gameType(channel.name)
+        game.sessionKey = key
+        sessions[key] = game
+        timers.schedule(idleTimeout, lambda: expireGame(game))
+    return game
+
+async def expireGame(g):
+    async with g.lock:
+        if sessions.get(g.sessionKey) is not g:
+            return
+        idle = time.monotonic() - g.lastActivity
+        if idle < idleTimeout:
+            timers.schedule(idleTimeout - idle, lambda: expireGame(g))
+            return
+        if g.channel is not None:
+            g.sendMessage("This game has been closed after being idle for too long")
+        g.teardown()
+        deliveries = g.queueOutbound()
+        del sessions[g.sessionKey]
+        metrics.inc("games_expired_total", game=g.gameType())
+    await fanOut(deliveries)
+
+class TopicStore:
+    def __init__(self, path):
+        self.path = path
+        self.topics = None
+        self.byCategory = dict()
+        self.bags = dict()
+        self.mtime = None
+    def load(self):
+        mtime = os.stat(self.path).st_mtime
+        topics = []
+        byCategory = dict()
+        with open(self.path, newline='') as csvfile:
+            spamreader = csv.reader(csvfile, delimiter=',', quotechar='|')
+            for row in spamreader:
+                byCategory.setdefault(row[0], []).append(len(topics))
+                topics.append((row[0], row[1]))
+        self.topics = topics
+        self.byCategory = byCategory
+        self.bags = dict()
+        self.mtime = mtime
+    def reloadIfChanged(self):
+        if self.topics is None or os.stat(self.path).st_mtime != self.mtime:
+            self.load()
+    def getCategories(self):
+        self.reloadIfChanged()
+        return list(self.byCategory)
+    def draw(self, key, category=None):
+        self.reloadIfChanged()
+        bag = self.bags.get((key, category))
+        if not bag:
+            if category is None:
+                bag = list(range(len(self.topics)))
+            else:
+                bag = list(self.byCategory[category])
+            #not the game's rng, so recovery can replay a game without the bag it drew from
+            random.shuffle(bag)
+            self.bags[(key, category)] = bag
+        return self.topics[bag.pop()]
+
+topicStore = TopicStore(os.getenv('ROBBOT_WORDS', 'words.csv'))
 
 @bot.command()
 async def foo(ctx):
@@ -728,86 +1640,222 @@ async def on_ready():
     members = '\n - '.join([member.name for member in guild.members])
     print(f'Guild Members:\n - {members}')
     print(f'{client.user} has connected to Discord!')
+    global eventLog
+    if eventLog is None:
+        eventLog = EventLog(eventLogPath)
+        await recoverGames(eventLog)
+        eventLog.start()
+        timers.start()
+        if tracePath:
+            startTrace(tracePath)
+        if timelinePath:
+            startTimeline(timelinePath)
+    if statsStore is None and statsPath:
+        startStats(statsPath)
+    global metricsStarted
+    if not metricsStarted:
+        metricsStarted = True
+        await startMetrics()
 
-async def lock():
-    while not (await lockHandler()):
-        pass
-async def lockHandler():
-    global spinLock
-    if spinLock == 1:
-        await asyncio.sleep(0)
-        return False
-    else:
-        spinLock = 1
-        print("ACQUIRED LOCK")
-        return True
-def unlock():
-    global spinLock
-    print("RELEASED LOCK")
-    spinLock = 0
+async def startMetrics():
+    port = os.getenv('ROBBOT_METRICS_PORT')
+    if port:
+        await metrics.serve(int(port))
+    path = os.getenv('ROBBOT_METRICS_FILE')
+    if path:
+        asyncio.ensure_future(metrics.dumpPeriodically(path, float(os.getenv('ROBBOT_METRICS_INTERVAL', '60'))))
+
+async def recoverGames(log):
+    tails = dict()
+    for event in log.read():
+        key = tuple(event["s"])
+        if event["e"] == "closed":
+            tails[key] = [event]
+        else:
+            tails.setdefault(key, []).append(event)
+    kept = []
+    for key, events in tails.items():
+        #keep tails for channels that are not resolvable yet, a guild can be unavailable at READY
+        kept.extend(events)
+        channel = client.get_channel(key[1])
+        if channel is None:
+            continue
+        g = getGame(channel)
+        if g is None:
+            continue
+        async with g.acquire():
+            g.replaying = True
+            try:
+                for event in events:
+                    replayEvent(g, channel, event)
+            finally:
+                g.replaying = False
+            g.armDeadlines()
+        print(f'Recovered {channel.name} from {len(events)} events')
+    log.rewrite(kept)
+
+def replayEvent(g, channel, event):
+    kind = event["e"]
+    if kind == "closed":
+        for ref in event["members"]:
+            member = resolveMember(ref, channel)
+            if member is not None and member not in g.members:
+                g.addMember(member)
+    elif kind == "join" or kind == "leave":
+        member = resolveMember(event["m"], channel)
+        if member is not None:
+            handle_game_message(g, member, kind, channel)
+    elif kind == "start":
+        g.start(channel, event["seed"], event.get("topic") or drawTopic(g))
+    elif kind == "end":
+        g.endGame()
+    elif kind == "answer" or kind == "abstain":
+        member = resolveMember(event["m"], channel)
+        for p in promptRoutes.get(member, []):
+            if p.game == g:
+                if kind == "answer":
+                    p.answer(event["a"])
+                else:
+                    p.abstain()
+                break
 
 @client.event
+@timed("on_message_seconds")
 async def on_message(message):
-    global games
     if message.author != client.user:
+        metrics.inc("inbound_messages_total")
         if isinstance(message.channel, discord.DMChannel):
-            await lock()
-            await handle_direct_message(message.author, message.content)
-            unlock()
+            await dispatchDirect(message.author, message.content)
         else:
             words = message.content.split()
-            if(words[0] == "fakesay"):
-                await tlock()
-                await handle_general_message(getFakePlayer(words[1], message.channel), " ".join(words[2:]), message.channel)
-                unlock()
-            elif(words[0] == "fakedm"):
-                await lock()
-                await handle_direct_message(getFakePlayer(words[1], message.channel), " ".join(words[2:]))
-                unlock()
-            elif(words[0] == "quicksetup"):
-                for i in range(int(words[1])):
-                     pname = "p" + str(i + 1)
-                     await lock()
-                     await handle_general_message(getFakePlayer(pname, message.channel), "join", message.channel)
-                     unlock()
-            elif(words[0] == "quickdm"):
-                for i in range(int(words[1])):
-                     pname = "p" + str(i + 1)
-                     await lock()
-                     await handle_direct_message(getFakePlayer(pname, message.channel), " ".join(words[2:]))
-                     unlock()
-            else:
-                await lock()
-                await handle_general_message(message.author, message.content, message.channel)
-                unlock()
+            if len(words) == 0:
+                return
+            command = channelCommands.get(words[0])
+            if command is None:
+                await dispatchGeneral(message.author, message.content, message.channel)
+            elif len(words) >= command[1]:
+                await command[0](words, message.channel)
+
+async def fakeSayCommand(words, channel):
+    await dispatchGeneral(getFakePlayer(words[1], channel), " ".join(words[2:]), channel)
+
+async def fakeDMCommand(words, channel):
+    await dispatchDirect(getFakePlayer(words[1], channel), " ".join(words[2:]), channel)
+
+async def quickSetupCommand(words, channel):
+    if words[1].isdigit():
+        for i in range(int(words[1])):
+            await dispatchGeneral(getFakePlayer("p" + str(i + 1), channel), "join", channel)
+
+async def quickDMCommand(words, channel):
+    if words[1].isdigit():
+        for i in range(int(words[1])):
+            await dispatchDirect(getFakePlayer("p" + str(i + 1), channel), " ".join(words[2:]), channel)
 
+async def leaderboardCommand(words, channel):
+    gameType = gameTypes.get(channel.name)
+    if statsStore is None or gameType is None or outbox.congested():
+        return
+    rows = await statsStore.fetchLeaderboard(gameType.__name__)
+    lines = [str(i + 1) + ". " + name + ": " + str(wins) + " wins in " + str(games) + " games" for i, (name, wins, games) in enumerate(rows)]
+    await outbox.queue(channel, "--LEADERBOARD--\n" + ("\n".join(lines) if len(lines) > 0 else "No games recorded yet"), chatterPriority)
+
+#command name -> (handler, minimum number of words)
+channelCommands = {"fakesay": (fakeSayCommand, 2), "fakedm": (fakeDMCommand, 2), "quicksetup": (quickSetupCommand, 2), "quickdm": (quickDMCommand, 2), "leaderboard": (leaderboardCommand, 1)}
+
+async def dispatchGeneral(player, message, channel):
+    traceEvent("g", player, message, channel)
+    await handle_general_message(player, message, channel)
+
+async def dispatchDirect(player, message, baseChannel=None):
+    traceEvent("d", player, message, baseChannel)
+    await handle_direct_message(player, message)
+
+@timed("handle_direct_message_seconds")
 async def handle_direct_message(player, message):
-    for g in games:
-        if g.promptBarrier != None:
-            for p in g.promptBarrier.prompts:
-                if(p.member == player and not p.answered):
-                    await p.answer(message.lower())
-                    break
-        else:
-            if g.channel is not None and player in g.members:
-                await handle_general_message(player, message, g.channel)
+    p = getRoutedPrompt(player)
+    if p is not None:
+        async with p.game.acquire():
+            if getRoutedPrompt(player) is p:
+                p.answer(message.lower())
+            deliveries = p.game.queueOutbound()
+        await fanOut(deliveries)
+        return
+    message = message.strip().lower()
+    if getCommandName(message) not in gameCommands:
+        return
+    for g in list(memberGames.get(player, ())):
+        async with g.acquire():
+            if g.promptBarrier is None and g.channel is not None and player in g.members:
+                handle_game_message(g, player, message, g.channel)
+            deliveries = g.queueOutbound()
+        await fanOut(deliveries)
 
+@timed("handle_general_message_seconds")
 async def handle_general_message(player, message, channel):
-    global games
-    message = message.lower()
-    if(channel.name == "uwu"):
-        await channel.send("uwu")
-    for g in games:
-        if(channel.name == g.channel_name):
-            if message == "join":
-                g.addMember(player)
-                await g.sendQueue(channel)
-            if message == "leave" or message == "leaf":
-                g.removeMember(player)
-                await g.sendQueue(channel)
-            if message == "start":
-                await g.startGame(channel)
-            if message == "end":
-                await g.endGame()
-
-client.run(TOKEN)
+    message = message.strip().lower()
+    if(channel.name == "uwu" and not outbox.congested()):
+        await outbox.queue(channel, "uwu", chatterPriority)
+    if getCommandName(message) not in gameCommands:
+        metrics.inc("chatter_messages_total")
+        return
+    g = getGame(channel)
+    if g is not None:
+        async with g.acquire():
+            handle_game_message(g, player, message, channel)
+            deliveries = g.queueOutbound()
+        await fanOut(deliveries)
+
+def getCommandName(message):
+    return message.split(" ", 1)[0]
+
+def handle_game_message(g, player, message, channel):
+    words = message.split()
+    command = gameCommands.get(words[0]) if len(words) > 0 else None
+    if command is not None:
+        command(g, player, channel, words)
+
+def joinCommand(g, player, channel, words):
+    g.logEvent("join", m=memberRef(player))
+    g.addMember(player)
+    g.sendQueue(channel)
+
+def leaveCommand(g, player, channel, words):
+    if player in g.members:
+        g.logEvent("leave", m=memberRef(player))
+        g.removeMember(player)
+    g.sendQueue(channel)
+
+def drawTopic(g):
+    if g.usesTopics:
+        return list(topicStore.draw(g.sessionKey))
+    return None
+
+def startCommand(g, player, channel, words):
+    g.start(channel, topic=drawTopic(g))
+
+def endCommand(g, player, channel, words):
+    if g.running:
+        g.logEvent("end")
+        g.endGame()
+
+def deliveryCommand(g, player, channel, words):
+    if len(words) != 2 or words[1] not in deliveryPolicies:
+        g.sendMessageToChannel(channel, "Usage: delivery " + "|".join(deliveryPolicies), chatterPriority)
+    elif player in g.members:
+        g.flushDigest(player)
+        g.deliveryOverrides[player] = words[1]
+        g.sendMessageToChannel(channel, player.name + " will now get game messages by " + words[1], chatterPriority)
+
+def gameDeliveryCommand(g, player, channel, words):
+    if len(words) != 2 or words[1] not in deliveryPolicies:
+        g.sendMessageToChannel(channel, "Usage: gamedelivery " + "|".join(deliveryPolicies), chatterPriority)
+    else:
+        g.flushDigests()
+        g.delivery = words[1]
+        g.sendMessageToChannel(channel, "Game messages will now be delivered by " + words[1], chatterPriority)
+
+gameCommands = {"join": joinCommand, "leave": leaveCommand, "leaf": leaveCommand, "start": startCommand, "end": endCommand, "delivery": deliveryCommand, "gamedelivery": gameDeliveryCommand}
+
+if __name__ == "__main__":
+    client.run(TOKEN)
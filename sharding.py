@@ -0,0 +1,377 @@
+import argparse
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import os
+import queue
+import time
+import discord
+import robbotv2 as bot
+
+# Guilds are owned by shard (guild_id >> 22) % shardCount, the same split Discord uses for gateway shards.
+# DMs have no guild, so workers report which of their sessions each member sits in and the router follows that.
+
+def getShard(guildId, shardCount):
+    if guildId is None:
+        return 0
+    return (guildId >> 22) % shardCount
+
+def packMessage(message):
+    if isinstance(message.channel, discord.DMChannel):
+        return ("message", None, None, None, message.author.id, message.author.name, message.content)
+    guild = getattr(message.channel, "guild", None)
+    return ("message", guild.id if guild is not None else None, message.channel.id, message.channel.name, message.author.id, message.author.name, message.content)
+
+class ProxyGuild:
+    def __init__(self, id):
+        self.id = id
+        self.members = dict()
+    def get_member(self, id):
+        return self.members.get(id)
+
+class ProxyChannel:
+    def __init__(self, results, id, name, guild):
+        self.results = results
+        self.id = id
+        self.name = name
+        self.guild = guild
+    async def send(self, content):
+        self.results.put(("send", self.id, content))
+
+class ProxyDMChannel(discord.DMChannel):
+    def __init__(self, results, recipient):
+        self.results = results
+        self.id = recipient.id
+        self.recipient = recipient
+    async def send(self, content):
+        self.results.put(("dm", self.recipient.id, content))
+
+class ProxyMember:
+    def __init__(self, results, id, name):
+        self.results = results
+        self.id = id
+        self.name = name
+        self.dm_channel = None
+    async def create_dm(self):
+        if self.dm_channel is None:
+            self.dm_channel = ProxyDMChannel(self.results, self)
+        return self.dm_channel
+
+class ProxyMessage:
+    def __init__(self, author, channel, content):
+        self.author = author
+        self.channel = channel
+        self.content = content
+
+class ShardWorker:
+    sweepInterval = 1.0
+    def __init__(self, shard, inbox, results):
+        self.shard = shard
+        self.inbox = inbox
+        self.results = results
+        self.guilds = dict()
+        self.channels = dict()
+        self.members = dict()
+        self.seated = set()
+    def getGuild(self, id):
+        if id not in self.guilds:
+            self.guilds[id] = ProxyGuild(id)
+        return self.guilds[id]
+    def getChannel(self, id, name, guildId):
+        if id not in self.channels:
+            self.channels[id] = ProxyChannel(self.results, id, name, self.getGuild(guildId) if guildId is not None else None)
+        return self.channels[id]
+    def getMember(self, id, name, guild):
+        member = self.members.get(id)
+        if member is None:
+            member = ProxyMember(self.results, id, name)
+            self.members[id] = member
+        if guild is not None:
+            guild.members[id] = member
+        return member
+    def takeEvents(self):
+        events = [self.inbox.get()]
+        while True:
+            try:
+                events.append(self.inbox.get_nowait())
+            except queue.Empty:
+                return events
+    async def handle(self, event):
+        kind, guildId, channelId, channelName, authorId, authorName, content = event
+        if channelId is None:
+            author = self.members.get(authorId)
+            if author is None:
+                return
+            channel = await author.create_dm()
+        else:
+            channel = self.getChannel(channelId, channelName, guildId)
+            author = self.getMember(authorId, authorName, channel.guild)
+        await bot.on_message(ProxyMessage(author, channel, content))
+        self.reportSeat(author)
+    def reportSeat(self, member):
+        seated = member in bot.memberGames
+        if seated != (member.id in self.seated):
+            if seated:
+                self.seated.add(member.id)
+            else:
+                self.seated.discard(member.id)
+            self.results.put(("member", self.shard, member.id, seated))
+        if not seated and member not in bot.promptRoutes:
+            self.members.pop(member.id, None)
+            for guild in self.guilds.values():
+                guild.members.pop(member.id, None)
+    async def sweep(self):
+        #games torn down by a timer unseat members without any message from them
+        while True:
+            await asyncio.sleep(self.sweepInterval)
+            for member in list(self.members.values()):
+                self.reportSeat(member)
+    async def run(self):
+        #the router's outbox is the single client in front of Discord, so only it applies rate limits
+        bot.sendPeriod = 0
+        bot.timers.start()
+        #workers never see on_ready; each one records the games it hosts into the shared WAL database
+        if bot.statsPath:
+            bot.startStats(bot.statsPath)
+        sweep = asyncio.ensure_future(self.sweep())
+        loop = asyncio.get_event_loop()
+        while True:
+            for event in await loop.run_in_executor(None, self.takeEvents):
+                if event is None:
+                    sweep.cancel()
+                    if bot.statsStore is not None:
+                        bot.statsStore.flush()
+                    return
+                if event[0] == "sync":
+                    self.results.put(("synced", self.shard, event[1]))
+                    continue
+                try:
+                    await self.handle(event)
+                except Exception as e:
+                    print(f'Shard {self.shard} failed to handle {event[0]}: {e!r}')
+
+def runWorker(shard, inbox, results):
+    asyncio.run(ShardWorker(shard, inbox, results).run())
+
+class ShardRouter:
+    heldLimit = 1024
+    heldPerMember = 16
+    heldWindow = 2.0
+    def __init__(self, shardCount, gateway):
+        self.shardCount = shardCount
+        self.gateway = gateway
+        self.context = multiprocessing.get_context("spawn")
+        self.inboxes = [self.context.Queue() for i in range(shardCount)]
+        self.results = self.context.Queue()
+        self.workers = []
+        self.memberShards = dict()
+        self.heldDMs = dict()
+        self.outbox = bot.Outbox()
+        self.deliveries = set()
+        self.syncToken = 0
+        self.syncPending = 0
+        self.synced = None
+    def start(self):
+        for shard in range(self.shardCount):
+            worker = self.context.Process(target=runWorker, args=(shard, self.inboxes[shard], self.results), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+    def stop(self):
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.results.put(None)
+    def dispatch(self, event):
+        bot.metrics.inc("router_inbound_total")
+        if event[2] is None:
+            shards = self.memberShards.get(event[4])
+            if shards is None:
+                self.holdDM(event)
+                return
+        else:
+            shards = [getShard(event[1], self.shardCount)]
+        for shard in shards:
+            self.inboxes[shard].put(event)
+    def holdDM(self, event):
+        #the worker that seated this member may not have reported it yet, so keep the DM briefly in case it does
+        now = time.monotonic()
+        held = [h for h in self.heldDMs.pop(event[4], []) if now - h[0] < self.heldWindow]
+        held.append((now, event))
+        self.heldDMs[event[4]] = held[-self.heldPerMember:]
+        bot.metrics.inc("router_dms_held_total")
+        while now - self.heldDMs[next(iter(self.heldDMs))][-1][0] >= self.heldWindow:
+            bot.metrics.inc("router_dms_expired_total", len(self.heldDMs.pop(next(iter(self.heldDMs)))))
+        if len(self.heldDMs) > self.heldLimit:
+            memberId = next(iter(self.heldDMs))
+            dropped = self.heldDMs.pop(memberId)
+            bot.metrics.inc("router_dms_dropped_total", len(dropped))
+            print(f'Dropped {len(dropped)} DMs from {memberId}, who is not seated on any shard')
+    def releaseDMs(self, memberId, shard):
+        now = time.monotonic()
+        for heldAt, event in self.heldDMs.pop(memberId, ()):
+            if now - heldAt < self.heldWindow:
+                self.inboxes[shard].put(event)
+            else:
+                bot.metrics.inc("router_dms_expired_total")
+    def deliver(self, deliveries):
+        if len(deliveries) > 0:
+            task = asyncio.ensure_future(bot.fanOut(deliveries))
+            self.deliveries.add(task)
+            task.add_done_callback(self.deliveries.discard)
+    async def sync(self):
+        self.syncToken = self.syncToken + 1
+        self.syncPending = self.shardCount
+        self.synced = asyncio.get_event_loop().create_future()
+        for inbox in self.inboxes:
+            inbox.put(("sync", self.syncToken))
+        await self.synced
+    def takeResults(self):
+        results = [self.results.get()]
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+    async def pump(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            deliveries = dict()
+            synced = 0
+            for result in await loop.run_in_executor(None, self.takeResults):
+                if result is None:
+                    self.deliver(deliveries)
+                    await asyncio.gather(*self.deliveries)
+                    return
+                kind = result[0]
+                if kind == "send":
+                    deliveries[self.outbox.enqueue(("channel", result[1]), functools.partial(self.gateway.sendToChannel, result[1]), result[2])] = result[1]
+                elif kind == "dm":
+                    deliveries[self.outbox.enqueue(("member", result[1]), functools.partial(self.gateway.sendToMember, result[1]), result[2])] = result[1]
+                elif kind == "member":
+                    shards = self.memberShards.setdefault(result[2], set())
+                    if result[3]:
+                        shards.add(result[1])
+                        self.releaseDMs(result[2], result[1])
+                    else:
+                        shards.discard(result[1])
+                        if len(shards) == 0:
+                            del self.memberShards[result[2]]
+                elif kind == "synced" and result[2] == self.syncToken:
+                    synced = synced + 1
+            self.deliver(deliveries)
+            if synced > 0:
+                self.syncPending = self.syncPending - synced
+                if self.syncPending == 0 and not self.synced.done():
+                    self.synced.set_result(None)
+
+class DiscordGateway:
+    def __init__(self, token):
+        self.token = token
+        self.client = discord.Client()
+        self.router = None
+        self.pump = None
+    def attach(self, router):
+        self.router = router
+        @self.client.event
+        async def on_ready():
+            print(f'{self.client.user} has connected to Discord with {router.shardCount} shards!')
+            #ready fires again after every reconnect, but only one pump may read the results queue
+            if self.pump is None:
+                self.pump = asyncio.ensure_future(router.pump())
+        @self.client.event
+        async def on_message(message):
+            if message.author != self.client.user:
+                router.dispatch(packMessage(message))
+    async def sendToChannel(self, id, content):
+        await self.client.get_channel(id).send(content)
+    async def sendToMember(self, id, content):
+        user = self.client.get_user(id)
+        if user is None:
+            user = await self.client.fetch_user(id)
+        await user.send(content)
+    def run(self):
+        self.client.run(self.token)
+
+class LocalGateway:
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.router = None
+        self.sent = []
+    def attach(self, router):
+        self.router = router
+    def newId(self):
+        return next(self.ids) << 22
+    def say(self, guildId, channelId, channelName, memberId, memberName, content):
+        self.router.dispatch(("message", guildId, channelId, channelName, memberId, memberName, content))
+    def dm(self, memberId, memberName, content):
+        self.router.dispatch(("message", None, None, None, memberId, memberName, content))
+    async def sendToChannel(self, id, content):
+        self.sent.append((id, content))
+    async def sendToMember(self, id, content):
+        self.sent.append((id, content))
+
+class LocalTable:
+    def __init__(self, gateway, playerCount):
+        self.gateway = gateway
+        self.guild = gateway.newId()
+        self.channel = gateway.newId()
+        self.players = [(gateway.newId(), "t" + str(self.channel >> 22) + "p" + str(i + 1)) for i in range(playerCount)]
+    def say(self, player, content):
+        self.gateway.say(self.guild, self.channel, "one-night-werewolf", player[0], player[1], content)
+    def everyone(self, content):
+        for player in self.players:
+            self.say(player, content)
+    def answer(self, content):
+        for player in self.players:
+            self.gateway.dm(player[0], player[1], content)
+
+async def runLocal(args):
+    gateway = LocalGateway()
+    router = ShardRouter(args.shards, gateway)
+    gateway.attach(router)
+    router.start()
+    pump = asyncio.ensure_future(router.pump())
+    tables = [LocalTable(gateway, args.players) for i in range(args.guilds)]
+    await router.sync()
+    start = time.perf_counter()
+    for round in range(args.games):
+        for table in tables:
+            table.everyone("join")
+            table.say(table.players[0], "start")
+        await router.sync()
+        for table in tables:
+            table.answer("nothing")
+            table.say(table.players[0], "end")
+            table.answer(table.players[0][1])
+            table.everyone("leave")
+        await router.sync()
+    elapsed = time.perf_counter() - start
+    router.stop()
+    await pump
+    games = args.games * args.guilds
+    print(f'{args.shards} shards, {args.guilds} guilds, {games} one-night-werewolf games')
+    print(f'  games/s:        {games / elapsed:.1f}')
+    print(f'  messages/game:  {len(gateway.sent) / games:.1f}')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the bot as a router in front of several worker processes")
+    parser.add_argument("--shards", type=int, default=os.cpu_count())
+    parser.add_argument("--local", action="store_true", help="play scripted games through a local stand-in gateway instead of Discord")
+    parser.add_argument("--guilds", type=int, default=16)
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--players", type=int, default=5)
+    parser.add_argument("--send-period", type=float, help="per-destination rate limit window in seconds, 0 disables it (defaults to ROBBOT_SEND_PERIOD, or 0 with --local)")
+    args = parser.parse_args()
+    if args.send_period is None:
+        args.send_period = 0 if args.local else bot.sendPeriod
+    bot.sendPeriod = args.send_period
+    if args.local:
+        asyncio.run(runLocal(args))
+    else:
+        gateway = DiscordGateway(bot.TOKEN)
+        router = ShardRouter(args.shards, gateway)
+        gateway.attach(router)
+        router.start()
+        gateway.run()
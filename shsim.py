@@ -0,0 +1,302 @@
+import argparse
+import concurrent.futures
+import time
+import numpy as np
+
+liberalTeam = 0
+fascistTeam = 1
+hitlerTeam = 2
+
+noPower = 0
+investigatePower = 1
+peekPower = 2
+specialElectionPower = 3
+executionPower = 4
+powerNames = ["none", "investigate", "peek", "special election", "execution"]
+
+winCauses = ["liberal policies", "hitler executed", "fascist policies", "hitler elected"]
+liberalPoliciesWin = 0
+hitlerExecutedWin = 1
+fascistPoliciesWin = 2
+hitlerElectedWin = 3
+
+def getRoles(playerCount):
+    if playerCount <= 6:
+        fascists = 1
+    elif playerCount <= 8:
+        fascists = 2
+    else:
+        fascists = 3
+    return [liberalTeam] * (playerCount - fascists - 1) + [fascistTeam] * fascists + [hitlerTeam]
+
+def getPowerTable(playerCount):
+    # Mirrors the executive powers in SecretHitlerGame.playPolicyPhase, indexed by fascist policies passed.
+    if playerCount <= 6:
+        return [noPower, noPower, noPower, peekPower, executionPower, executionPower, noPower]
+    elif playerCount <= 8:
+        return [noPower, noPower, investigatePower, specialElectionPower, executionPower, executionPower, noPower]
+    return [noPower, investigatePower, investigatePower, specialElectionPower, executionPower, executionPower, noPower]
+
+class Rules:
+    def __init__(self, deckFascist=11, deckLiberal=6, liberalWin=5, fascistWin=6, vetoAt=5, hitlerZoneAt=3, resetTrackerOnElection=False):
+        self.deckFascist = deckFascist
+        self.deckLiberal = deckLiberal
+        self.liberalWin = liberalWin
+        self.fascistWin = fascistWin
+        self.vetoAt = vetoAt
+        self.hitlerZoneAt = hitlerZoneAt
+        self.resetTrackerOnElection = resetTrackerOnElection
+
+class Strategy:
+    def __init__(self, yesRate=0.6, fascistCollusion=0.5):
+        self.yesRate = yesRate
+        self.fascistCollusion = fascistCollusion
+
+class Report:
+    def __init__(self, maxRounds):
+        self.games = 0
+        self.wins = np.zeros(len(winCauses), dtype=np.int64)
+        self.unfinished = 0
+        self.rounds = np.zeros(maxRounds + 1, dtype=np.int64)
+        self.powers = np.zeros(len(powerNames), dtype=np.int64)
+        self.gamesWithPower = np.zeros(len(powerNames), dtype=np.int64)
+        self.riots = 0
+        self.vetoes = 0
+        self.reshuffles = 0
+        self.elapsed = 0.0
+    def merge(self, other):
+        self.games = self.games + other.games
+        self.wins = self.wins + other.wins
+        self.unfinished = self.unfinished + other.unfinished
+        self.rounds = self.rounds + other.rounds
+        self.powers = self.powers + other.powers
+        self.gamesWithPower = self.gamesWithPower + other.gamesWithPower
+        self.riots = self.riots + other.riots
+        self.vetoes = self.vetoes + other.vetoes
+        self.reshuffles = self.reshuffles + other.reshuffles
+        self.elapsed = max(self.elapsed, other.elapsed)
+    def roundPercentile(self, q):
+        cumulative = np.cumsum(self.rounds)
+        return int(np.searchsorted(cumulative, q * cumulative[-1]))
+    def format(self):
+        g = max(1, self.games)
+        liberal = self.wins[liberalPoliciesWin] + self.wins[hitlerExecutedWin]
+        fascist = self.wins[fascistPoliciesWin] + self.wins[hitlerElectedWin]
+        lines = [f'games:            {self.games}']
+        lines.append(f'liberal wins:     {liberal / g:.4f}')
+        lines.append(f'fascist wins:     {fascist / g:.4f}')
+        for i in range(len(winCauses)):
+            lines.append(f'  {winCauses[i]:<16} {self.wins[i] / g:.4f}')
+        if self.unfinished > 0:
+            lines.append(f'unfinished:       {self.unfinished}')
+        meanRounds = (self.rounds * np.arange(len(self.rounds))).sum() / g
+        lines.append(f'rounds:           mean {meanRounds:.2f}, p50 {self.roundPercentile(0.5)}, p90 {self.roundPercentile(0.9)}, p99 {self.roundPercentile(0.99)}')
+        lines.append(f'riots per game:   {self.riots / g:.3f}')
+        lines.append(f'vetoes per game:  {self.vetoes / g:.3f}')
+        lines.append(f'reshuffles/game:  {self.reshuffles / g:.3f}')
+        lines.append('executive powers: per game, share of games')
+        for i in range(1, len(powerNames)):
+            lines.append(f'  {powerNames[i]:<16} {self.powers[i] / g:.3f}, {self.gamesWithPower[i] / g:.4f}')
+        if self.elapsed > 0:
+            lines.append(f'throughput:       {self.games / self.elapsed:.0f} games/s')
+        return "\n".join(lines)
+
+def firstTrue(mask):
+    return np.argmax(mask, axis=1)
+
+def randomSeat(rng, mask):
+    scores = np.where(mask, rng.random(mask.shape), -1.0)
+    return np.argmax(scores, axis=1)
+
+def nextAliveSeat(alive, start):
+    playerCount = alive.shape[1]
+    seats = (start[:, None] + np.arange(1, playerCount + 1)[None, :]) % playerCount
+    candidates = np.take_along_axis(alive, seats, axis=1)
+    return seats[np.arange(len(start)), firstTrue(candidates)]
+
+def simulate(games, playerCount, seed=None, rules=None, strategy=None, maxRounds=200):
+    rules = rules if rules is not None else Rules()
+    strategy = strategy if strategy is not None else Strategy()
+    rng = np.random.default_rng(seed)
+    start = time.perf_counter()
+    report = Report(maxRounds)
+    report.games = games
+    G = games
+    P = playerCount
+    rows = np.arange(G)
+    seats = np.arange(P)[None, :]
+    powerTable = np.array(getPowerTable(P))
+
+    roles = np.array(getRoles(P))
+    team = roles[np.argsort(rng.random((G, P)), axis=1)]
+    isFascist = team != liberalTeam
+    alive = np.ones((G, P), dtype=bool)
+    president = np.zeros(G, dtype=np.int64)
+    resumeFrom = np.full(G, -1)
+    lastPresident = np.full(G, -1)
+    lastChancellor = np.full(G, -1)
+    tracker = np.zeros(G, dtype=np.int64)
+    liberalPassed = np.zeros(G, dtype=np.int64)
+    fascistPassed = np.zeros(G, dtype=np.int64)
+    deckFascist = np.full(G, rules.deckFascist)
+    deckLiberal = np.full(G, rules.deckLiberal)
+    discardFascist = np.zeros(G, dtype=np.int64)
+    discardLiberal = np.zeros(G, dtype=np.int64)
+    done = np.zeros(G, dtype=bool)
+    cause = np.full(G, -1)
+    rounds = np.zeros(G, dtype=np.int64)
+    powerSeen = np.zeros((G, len(powerNames)), dtype=bool)
+
+    def finish(mask, winCause):
+        mask = mask & ~done
+        cause[mask] = winCause
+        done[mask] = True
+
+    def reshuffle(mask, needed):
+        mask = mask & (deckFascist + deckLiberal < needed)
+        deckFascist[mask] += discardFascist[mask]
+        deckLiberal[mask] += discardLiberal[mask]
+        discardFascist[mask] = 0
+        discardLiberal[mask] = 0
+        report.reshuffles += int(mask.sum())
+
+    def draw(mask, amount):
+        reshuffle(mask, amount)
+        drawn = np.zeros(G, dtype=np.int64)
+        idx = np.nonzero(mask)[0]
+        if len(idx) > 0:
+            drawn[idx] = rng.hypergeometric(deckFascist[idx], deckLiberal[idx], amount)
+        deckFascist[mask] -= drawn[mask]
+        deckLiberal[mask] -= amount - drawn[mask]
+        return drawn
+
+    for r in range(maxRounds):
+        active = ~done
+        if not active.any():
+            break
+        rounds[active] += 1
+        aliveCount = alive.sum(axis=1)
+        presidentTeam = team[rows, president]
+        presidentFascist = presidentTeam != liberalTeam
+
+        # Nomination: never the president, never the last chancellor, and the last president too with more than five alive.
+        eligible = alive & (seats != president[:, None]) & (seats != lastChancellor[:, None])
+        eligible = eligible & ~((aliveCount[:, None] > 5) & (seats == lastPresident[:, None]))
+        eligible = np.where(eligible.any(axis=1)[:, None], eligible, alive & (seats != president[:, None]))
+        scores = rng.random((G, P)) + np.where(isFascist & presidentFascist[:, None] & (rng.random(G) < strategy.fascistCollusion)[:, None], 1.0, 0.0)
+        chancellor = np.argmax(np.where(eligible, scores, -1.0), axis=1)
+        chancellorTeam = team[rows, chancellor]
+        chancellorFascist = chancellorTeam != liberalTeam
+
+        # Election: fascists back a fascist chancellor, everyone else votes yes at the configured rate.
+        yes = (rng.random((G, P)) < strategy.yesRate) | (isFascist & chancellorFascist[:, None])
+        yesVotes = (yes & alive).sum(axis=1)
+        passed = active & (yesVotes > aliveCount // 2)
+        failed = active & ~passed
+
+        lastPresident[passed] = president[passed]
+        lastChancellor[passed] = chancellor[passed]
+        if rules.resetTrackerOnElection:
+            tracker[passed] = 0
+        finish(passed & (fascistPassed >= rules.hitlerZoneAt) & (chancellorTeam == hitlerTeam), hitlerElectedWin)
+        legislating = passed & ~done
+
+        # Legislation: each side keeps its own policies when it can.
+        handFascist = draw(legislating, 3)
+        handLiberal = 3 - handFascist
+        presidentDiscardsFascist = np.where(presidentFascist, handLiberal == 0, handFascist > 0)
+        discardFascist[legislating & presidentDiscardsFascist] += 1
+        discardLiberal[legislating & ~presidentDiscardsFascist] += 1
+        handFascist = handFascist - presidentDiscardsFascist
+        handLiberal = 2 - handFascist
+        vetoed = legislating & (fascistPassed >= rules.vetoAt) & (handFascist == 2) & ~chancellorFascist & ~presidentFascist
+        report.vetoes += int(vetoed.sum())
+        discardFascist[vetoed] += 2
+        enacting = legislating & ~vetoed
+        playsFascist = np.where(chancellorFascist, handFascist > 0, handLiberal == 0)
+        discardFascist[enacting] += handFascist[enacting] - playsFascist[enacting]
+        discardLiberal[enacting] += handLiberal[enacting] - (~playsFascist[enacting])
+        enactedFascist = enacting & playsFascist
+        liberalPassed[enacting & ~playsFascist] += 1
+        fascistPassed[enactedFascist] += 1
+
+        # Failed elections move the tracker, and a third failure makes the populace riot.
+        tracker[failed] += 1
+        riot = failed & (tracker >= 3)
+        report.riots += int(riot.sum())
+        tracker[riot] = 0
+        lastPresident[riot] = -1
+        lastChancellor[riot] = -1
+        riotFascist = draw(riot, 1) == 1
+        fascistPassed[riot & riotFascist] += 1
+        liberalPassed[riot & ~riotFascist] += 1
+
+        finish(active & (liberalPassed >= rules.liberalWin), liberalPoliciesWin)
+        finish(active & (fascistPassed >= rules.fascistWin), fascistPoliciesWin)
+
+        # Executive powers only follow fascist policies enacted by a government.
+        power = np.where(enactedFascist & ~done, powerTable[np.minimum(fascistPassed, len(powerTable) - 1)], noPower)
+        for p in range(1, len(powerNames)):
+            fired = power == p
+            report.powers[p] += int(fired.sum())
+            powerSeen[fired, p] = True
+        others = alive & (seats != president[:, None])
+        shooting = power == executionPower
+        targets = np.where(presidentFascist[:, None], others & (team == liberalTeam), others)
+        targets = np.where(targets.any(axis=1)[:, None], targets, others)
+        target = randomSeat(rng, targets)
+        alive[rows[shooting], target[shooting]] = False
+        finish(shooting & (team[rows, target] == hitlerTeam), hitlerExecutedWin)
+
+        special = (power == specialElectionPower) & ~done
+        specialTarget = randomSeat(rng, others)
+        base = np.where(resumeFrom >= 0, resumeFrom, president)
+        resumeFrom[:] = -1
+        nextPresident = nextAliveSeat(alive, base)
+        resumeFrom[special] = president[special]
+        nextPresident[special] = specialTarget[special]
+        president = np.where(done, president, nextPresident)
+
+    for i in range(len(winCauses)):
+        report.wins[i] = int((cause == i).sum())
+    report.unfinished = int((~done).sum())
+    report.rounds += np.bincount(rounds, minlength=maxRounds + 1)[:maxRounds + 1]
+    report.gamesWithPower += powerSeen.sum(axis=0)
+    report.elapsed = time.perf_counter() - start
+    return report
+
+def simulateChunk(args):
+    games, playerCount, seed, rules, strategy, maxRounds = args
+    return simulate(games, playerCount, seed, rules, strategy, maxRounds)
+
+def simulateParallel(games, playerCount, workers, seed=None, rules=None, strategy=None, maxRounds=200, chunkSize=100000):
+    start = time.perf_counter()
+    chunks = [min(chunkSize, games - i) for i in range(0, games, chunkSize)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    report = Report(maxRounds)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        for part in pool.map(simulateChunk, [(c, playerCount, s, rules, strategy, maxRounds) for c, s in zip(chunks, seeds)]):
+            report.merge(part)
+    report.elapsed = time.perf_counter() - start
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched Monte Carlo simulation of Secret Hitler under the bot's rules")
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--players", type=int, nargs="+", default=[5, 6, 7, 8, 9, 10])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--yes-rate", type=float, default=0.6)
+    parser.add_argument("--fascist-collusion", type=float, default=0.5)
+    parser.add_argument("--reset-tracker-on-election", action="store_true")
+    args = parser.parse_args()
+    rules = Rules(resetTrackerOnElection=args.reset_tracker_on_election)
+    strategy = Strategy(args.yes_rate, args.fascist_collusion)
+    for playerCount in args.players:
+        print(f'--- {playerCount} players ---')
+        if args.workers > 1:
+            report = simulateParallel(args.games, playerCount, args.workers, args.seed, rules, strategy, chunkSize=args.chunk_size)
+        else:
+            report = simulate(args.games, playerCount, args.seed, rules, strategy)
+        print(report.format())